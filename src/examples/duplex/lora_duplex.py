@@ -1,15 +1,22 @@
 import time
-from sx127x import config
+from sx127x import config, frame
+from sx127x.ring import PacketRing
 
 
+NODE_ID = frame.node_id(config.CONFIG.NODE_EUI)
+
 msgCount = 0            # count of outgoing messages
 INTERVAL = 2000         # interval between sends
 INTERVAL_BASE = 2000    # interval between sends base
+
+outgoing = bytearray(frame.HEADER_LENGTH + frame.MAX_VARINT_LENGTH)
+fields = [0]
  
 
 def duplex_callback(lora):
     print("LoRa Duplex with callback")
-    lora.onReceive(on_receive)  # register the receive callback
+    lora.setReceiveRing(PacketRing())  # on_packet blinks and redraws, keep it out of the IRQ
+    lora.onPacket(on_packet)  # register the receive callback
     do_loop(lora)
 
 
@@ -27,22 +34,30 @@ def do_loop(lora):
             lastSendTime = now                                      # timestamp the message
             interval = (lastSendTime % INTERVAL) + INTERVAL_BASE    # 2-3 seconds
             
-            message = "{} {}".format(config.CONFIG.NODE_NAME, msgCount)
-            send_message(lora, message)                              # send message
+            length = frame.pack_into(outgoing, frame.TYPE_DATA, NODE_ID, msgCount, (msgCount,))
+            send_message(lora, memoryview(outgoing)[:length])       # send message
             msgCount += 1 
 
             lora.receive()                                          # go into receive mode
 
+        lora.memory_policy.idle()                                   # deferred garbage collection
+
 
 def send_message(lora, outgoing):
-    lora.println(outgoing)
-    print("Sending message:\n{}\n".format(outgoing))
+    lora.beginPacket()
+    lora.write(outgoing)
+    lora.endPacket()
+    print("Sending message:\n{:04x} {}\n".format(NODE_ID, msgCount))
 
 
-def on_receive(lora, payload):
+def on_packet(lora, packet):
+    # dispatched after the IRQ, packet.rssi was captured with the packet
     lora.blink_led()   
-    payload_string = payload.decode()
-    rssi = lora.packetRssi()
+    frame_type, source, seq, flags, count = frame.unpack_from(packet.payload, fields)
+    if frame_type != frame.TYPE_DATA or count < 1:
+        return                                                      # not one of ours
+    payload_string = "{:04x} {}".format(source, fields[0])
+    rssi = packet.rssi
     print("*** Received message ***\n{}".format(payload_string))
     if config.CONFIG.IS_TTGO_LORA_OLED:
         lora.show_packet(payload_string, rssi)
@@ -0,0 +1,46 @@
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+from sx127x import config, frame
+from sx127x.async_sx127x import AsyncSX127x
+
+
+NODE_ID = frame.node_id(config.CONFIG.NODE_EUI)
+
+INTERVAL = 2000         # interval between sends
+INTERVAL_BASE = 2000    # interval between sends base
+
+
+def duplex_async(lora):
+    print("LoRa Duplex with uasyncio")
+    radio = AsyncSX127x(lora)
+    asyncio.run(main(radio))
+
+
+async def main(radio):
+    await asyncio.gather(send_loop(radio), receive_loop(radio))
+
+
+async def send_loop(radio):
+    msgCount = 0
+    outgoing = bytearray(frame.HEADER_LENGTH + frame.MAX_VARINT_LENGTH)
+
+    while True:
+        length = frame.pack_into(outgoing, frame.TYPE_DATA, NODE_ID, msgCount, (msgCount,))
+        await radio.send(memoryview(outgoing)[:length])
+        print("Sending message:\n{:04x} {}\n".format(NODE_ID, msgCount))
+        msgCount += 1
+
+        await asyncio.sleep(((config.millisecond() % INTERVAL) + INTERVAL_BASE) / 1000)   # 2-3 seconds
+
+
+async def receive_loop(radio):
+    fields = [0]
+    async for packet in radio.packets():
+        frame_type, source, seq, flags, count = frame.unpack_from(packet.payload, fields)
+        if frame_type != frame.TYPE_DATA or count < 1:
+            continue                                                # not one of ours
+        print("*** Received message ***\n{:04x} {}".format(source, fields[0]))
+        print("with RSSI {}\n".format(packet.rssi))
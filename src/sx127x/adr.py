@@ -0,0 +1,231 @@
+from array import array
+from math import log
+
+from sx127x import frame
+from sx127x.clock import ticks_ms, ticks_diff
+
+
+# demodulator SNR floor per spreading factor, quarter dB, SF6..SF12
+REQUIRED_SNR = (-20, -30, -40, -50, -60, -70, -80)
+
+
+class AdrEngine:
+    """
+    Adaptive data rate from per-peer link statistics.
+
+    Every received frame updates a bounded, array-backed table of the sender's
+    EWMA-smoothed SNR and RSSI and its loss rate (from gaps in sequence numbers).
+    recommend() picks the fastest SF / bandwidth that keeps margin_db above the
+    demodulation floor, and the lowest TX power for the peer that still does.
+    SF and bandwidth are shared by both ends, so a change is negotiated with an
+    ADR frame that the peer acknowledges before both switch. A node that switched
+    and hears nothing from the peer within fallback_ms goes back to the old profile.
+
+    SF and bandwidth apply to the whole radio, so negotiation is limited to a
+    point-to-point link: requests are neither sent nor followed while the table
+    holds another peer. With more peers recommend() still tracks each link.
+    """
+
+    def __init__(self, lora, node_id, capacity = 8, margin_db = 10, alpha_shift = 3,
+                 max_loss = 0.1, min_power = 2, max_power = 17,
+                 spreading_factors = (7, 8, 9, 10, 11, 12), bandwidths = (125E3, 250E3, 500E3),
+                 fallback_ms = 60000):
+        self.lora = lora
+        self.node_id = node_id
+        self.capacity = capacity
+        self.margin = margin_db * 4
+        self.alpha_shift = alpha_shift
+        self.max_loss = int(max_loss * 256)
+        self.min_power = min_power
+        self.max_power = max_power
+        self.bandwidths = bandwidths
+        self.fallback_ms = fallback_ms
+
+        # per-peer table
+        self.peers = array('i', [-1] * capacity)        # node id, -1 when free
+        self.snr = array('i', [0] * capacity)           # EWMA, quarter dB
+        self.rssi = array('i', [0] * capacity)          # EWMA, dBm
+        self.loss = array('i', [0] * capacity)          # EWMA, 1/256
+        self.last_seq = bytearray(capacity)
+        self.last_seen = [0] * capacity                 # ticks_ms(), unbounded on CPython
+        self.power = bytearray(capacity)                # TX power the peer is using
+
+        # every (sf, bandwidth) pair, fastest first
+        candidates = [(sf * bw / 2**sf, sf, bw) for sf in spreading_factors for bw in bandwidths]
+        candidates.sort(reverse = True)
+        self.candidates = [(sf, bw) for rate, sf, bw in candidates]
+
+        self.requests = 0
+        self.switches = 0
+        self.fallbacks = 0
+        self._previous = None       # profile to return to, while waiting to hear the peer
+        self._peer = None           # the peer the profile was negotiated with
+        self._switched_at = 0
+        self._pending = {}          # peer -> requested (sf, bw, power)
+        self._buffer = bytearray(frame.HEADER_LENGTH + 4 * frame.MAX_VARINT_LENGTH)
+        self._fields = [0] * 4
+
+
+    def _slot(self, peer):
+        free = oldest = -1
+        now = ticks_ms()
+        for i in range(self.capacity):
+            if self.peers[i] == peer:
+                return i
+            if self.peers[i] < 0:
+                if free < 0:
+                    free = i
+            elif oldest < 0 or ticks_diff(now, self.last_seen[i]) > ticks_diff(now, self.last_seen[oldest]):
+                oldest = i
+
+        # new peer, replaces the least recently heard one when the table is full
+        i = free if free >= 0 else oldest
+        self.peers[i] = peer
+        self.loss[i] = 0
+        self.power[i] = self.lora.parameters['tx_power_level']
+        return i
+
+
+    def observe(self, peer, snr, rssi, seq):
+        """
+        Records a frame from peer, snr in dB (e.g. Packet.snr), rssi in dBm.
+        """
+
+        new = peer not in self.peers
+        i = self._slot(peer)
+        snr = int(snr * 4)
+        shift = self.alpha_shift
+
+        if new:
+            self.snr[i] = snr
+            self.rssi[i] = rssi
+        else:
+            self.snr[i] += (snr - self.snr[i]) >> shift
+            self.rssi[i] += (rssi - self.rssi[i]) >> shift
+            gap = (seq - self.last_seq[i]) & 0xff
+            if 0 < gap < 128:
+                self.loss[i] += ((gap - 1) * 256 // gap - self.loss[i]) >> shift
+
+        self.last_seq[i] = seq & 0xff
+        self.last_seen[i] = ticks_ms()
+        if peer == self._peer:
+            self._previous = None  # heard the peer, the current profile works
+
+
+    def recommend(self, peer):
+        """
+        Returns (spreading_factor, bandwidth, tx_power) for the link with peer, None if unknown.
+        """
+
+        if peer not in self.peers:
+            return None
+        i = self.peers.index(peer)
+        parameters = self.lora.parameters
+        current_sf = parameters['spreading_factor']
+        current_bw = parameters['signal_bandwidth']
+
+        snr = self.snr[i]
+        for sf, bw in self.candidates:
+            # 3 dB of noise per doubling of bandwidth
+            estimated = snr - int(12 * log(bw / current_bw) / log(2))
+            excess = estimated - REQUIRED_SNR[sf - 6] - self.margin
+            if excess < 0:
+                continue
+            if self.loss[i] > self.max_loss and sf <= current_sf and bw >= current_bw:
+                continue    # losing frames, do not speed up
+            power = max(min(self.power[i] - excess // 4, self.max_power), self.min_power)
+            return sf, bw, power
+
+        # nothing keeps the margin, slowest profile at full power
+        sf, bw = self.candidates[-1]
+        return sf, bw, self.max_power
+
+
+    def _single_peer(self, peer):
+        # True when no node but peer is in the table
+        for other in self.peers:
+            if other >= 0 and other != peer:
+                return False
+        return True
+
+
+    def request(self, peer):
+        # asks peer to switch to the recommended profile, returns it or None if unchanged
+        # or other peers share the channel.
+        if not self._single_peer(peer):
+            return None
+        profile = self.recommend(peer)
+        if profile is None:
+            return None
+        sf, bw, power = profile
+        parameters = self.lora.parameters
+        i = self.peers.index(peer)
+        if sf == parameters['spreading_factor'] and bw == parameters['signal_bandwidth'] and power == self.power[i]:
+            return None
+
+        self._pending[peer] = profile
+        self._send(peer, sf, bw, power, frame.FLAG_ACK_REQUESTED)
+        self.requests += 1
+        return profile
+
+
+    def _send(self, peer, sf, bw, power, flags):
+        length = frame.pack_into(self._buffer, frame.TYPE_ADR, self.node_id, self.requests,
+                                 (peer, sf, self.bandwidths.index(bw), power), flags)
+        lora = self.lora
+        lora.beginPacket()
+        lora.write(memoryview(self._buffer)[:length])
+        lora.endPacket()
+        lora.receive()
+
+
+    def on_frame(self, payload):
+        # feed received frames, returns True if it was an ADR frame for this node.
+        fields = self._fields
+        frame_type, source, seq, flags, count = frame.unpack_from(payload, fields)
+        if frame_type != frame.TYPE_ADR or count < 4 or fields[0] != self.node_id:
+            return False
+        if not (6 <= fields[1] <= 12 and 0 <= fields[2] < len(self.bandwidths) and
+                self.min_power <= fields[3] <= self.max_power):
+            return True  # ours, but not a profile this node can use
+
+        sf, bw, power = fields[1], self.bandwidths[fields[2]], fields[3]
+        if not self._single_peer(source):
+            # other nodes listen on this profile, it is not this link's to change
+            self._pending.pop(source, None)
+            return True
+        if flags & frame.FLAG_ACK_REQUESTED:
+            # request: acknowledge on the current profile, then switch and use the power asked for
+            self._send(source, sf, bw, power, 0)
+            self._switch(source, sf, bw, power)
+        elif self._pending.pop(source, None) == (sf, bw, power):
+            # acknowledgement: the peer has switched
+            if source in self.peers:
+                self.power[self.peers.index(source)] = power
+            self._switch(source, sf, bw, None)
+        return True
+
+
+    def _switch(self, peer, sf, bw, power):
+        parameters = self.lora.parameters
+        self._peer = peer
+        self._previous = (parameters['spreading_factor'], parameters['signal_bandwidth'],
+                          parameters['tx_power_level'])
+        self._switched_at = ticks_ms()
+        self.switches += 1
+
+        if power is None:
+            self.lora.configure(spreading_factor = sf, signal_bandwidth = bw)
+        else:
+            self.lora.configure(spreading_factor = sf, signal_bandwidth = bw, tx_power_level = power)
+        self.lora.receive()
+
+
+    def service(self):
+        # call from the main loop, reverts a switch the peer never followed
+        if self._previous and ticks_diff(ticks_ms(), self._switched_at) > self.fallback_ms:
+            sf, bw, power = self._previous
+            self._previous = None
+            self.fallbacks += 1
+            self.lora.configure(spreading_factor = sf, signal_bandwidth = bw, tx_power_level = power)
+            self.lora.receive()
@@ -0,0 +1,76 @@
+from sx127x.clock import ticks_ms, ticks_diff
+
+
+class Aggregator:
+    """
+    Packs small records into one LoRa frame, each prefixed with its length byte.
+    The frame is sent when the next record does not fit, when the oldest record
+    is max_age_ms old (see poll()), or on flush().
+    """
+
+    def __init__(self, lora, max_size = None, max_age_ms = 5000):
+        self.lora = lora
+        self.max_size = max_size or lora.max_payload_length()
+        self.max_age_ms = max_age_ms
+        self.buffer = bytearray(self.max_size)
+        self.length = 0
+        self.count = 0
+        self.first_at = 0
+        self.frames = 0
+
+
+    def add(self, record):
+        size = len(record)
+        if size > min(self.max_size - 1, 255):
+            raise ValueError('Record too long.')
+
+        if self.length + 1 + size > self.max_size:
+            self.flush()
+
+        if self.count == 0:
+            self.first_at = ticks_ms()
+        self.buffer[self.length] = size
+        self.buffer[self.length + 1: self.length + 1 + size] = record
+        self.length += 1 + size
+        self.count += 1
+
+        if self.length >= self.max_size - 1:
+            self.flush()
+
+
+    def println(self, string):
+        self.add(string.encode())
+
+
+    def poll(self):
+        # flushes on age, call from the main loop
+        if self.count and ticks_diff(ticks_ms(), self.first_at) >= self.max_age_ms:
+            self.flush()
+
+
+    def flush(self):
+        if not self.count:
+            return
+        lora = self.lora
+        lora.beginPacket()
+        lora.write(memoryview(self.buffer)[:self.length])
+        lora.endPacket()
+        self.length = 0
+        self.count = 0
+        self.frames += 1
+
+
+def records(payload):
+    """
+    Yields the records of an aggregated frame as memoryviews, stops at a truncated record.
+    """
+
+    payload = memoryview(payload)
+    offset = 0
+    while offset < len(payload):
+        size = payload[offset]
+        end = offset + 1 + size
+        if end > len(payload):
+            return
+        yield payload[offset + 1: end]
+        offset = end
@@ -0,0 +1,102 @@
+from array import array
+
+from sx127x.clock import ticks_ms, ticks_diff, ticks_add
+
+
+def symbol_time_us(spreading_factor, signal_bandwidth):
+    return 1E6 * 2**spreading_factor / signal_bandwidth
+
+
+def time_on_air_us(payload_length, spreading_factor, signal_bandwidth, coding_rate = 5,
+                   preamble_length = 8, implicitHeader = False, enable_CRC = False):
+    """
+    Semtech AN1200.13, LoRa Modem Designer's Guide. coding_rate is the denominator, 5..8.
+    """
+
+    sf = min(max(spreading_factor, 6), 12)
+    cr = min(max(coding_rate, 5), 8) - 4
+    symbol_time = symbol_time_us(sf, signal_bandwidth)
+    de = 1 if symbol_time > 16000 else 0    # LowDataRateOptimize
+    ih = 1 if implicitHeader else 0
+    crc = 1 if enable_CRC else 0
+
+    bits = 8 * payload_length - 4 * sf + 28 + 16 * crc - 20 * ih
+    symbols = 8 + max(-(-bits // (4 * (sf - 2 * de))) * (cr + 4), 0)
+    return int((preamble_length + 4.25 + symbols) * symbol_time)
+
+
+class AirtimeTable:
+    """
+    Time on air in microseconds for every payload length of one radio profile.
+    """
+
+    def __init__(self, spreading_factor, signal_bandwidth, coding_rate = 5,
+                 preamble_length = 8, implicitHeader = False, enable_CRC = False, max_length = 255):
+        self.symbol_time_us = symbol_time_us(spreading_factor, signal_bandwidth)
+        self.table = array('I', (time_on_air_us(n, spreading_factor, signal_bandwidth, coding_rate,
+                                                preamble_length, implicitHeader, enable_CRC)
+                                 for n in range(max_length + 1)))
+
+
+    @classmethod
+    def from_parameters(cls, parameters):
+        return cls(parameters['spreading_factor'], parameters['signal_bandwidth'],
+                   parameters['coding_rate'], parameters['preamble_length'],
+                   parameters['implicitHeader'], parameters['enable_CRC'])
+
+
+    def time_on_air_us(self, payload_length):
+        return self.table[payload_length]
+
+
+    def time_on_air_ms(self, payload_length):
+        return self.table[payload_length] / 1000
+
+
+class DutyCycle:
+    """
+    Per sub-band duty-cycle accounting. A transmission of T ms closes its
+    sub-band until T / duty_cycle ms after it started (the LoRaWAN Toff rule).
+    """
+
+    # ETSI EN 300 220 sub-bands as used by LoRaWAN EU868: (low Hz, high Hz, duty cycle)
+    EU868_BANDS = ((863000000, 865000000, 0.001),
+                   (865000000, 868000000, 0.01),
+                   (868000000, 868600000, 0.01),
+                   (868700000, 869200000, 0.001),
+                   (869400000, 869650000, 0.1),
+                   (869700000, 870000000, 0.01))
+
+    def __init__(self, bands = EU868_BANDS, max_delay_ms = None):
+        """
+        :param max_delay_ms: longest wait endPacket() accepts before rejecting, None to always wait.
+        """
+
+        self.bands = bands
+        self.max_delay_ms = max_delay_ms
+        self.opens_at = [ticks_ms()] * len(bands)   # ticks_ms when each sub-band is free again
+        self.airtime_ms = [0] * len(bands)          # total time on air per sub-band
+        self.rejected = 0
+
+
+    def band(self, frequency):
+        for i in range(len(self.bands)):
+            low, high, duty_cycle = self.bands[i]
+            if low <= frequency < high:
+                return i
+        return -1
+
+
+    def delay_ms(self, frequency):
+        # how long until the sub-band of frequency may transmit, 0 if now.
+        i = self.band(frequency)
+        if i < 0:
+            return 0
+        return max(ticks_diff(self.opens_at[i], ticks_ms()), 0)
+
+
+    def record(self, frequency, airtime_ms):
+        i = self.band(frequency)
+        if i >= 0:
+            self.opens_at[i] = ticks_add(ticks_ms(), int(airtime_ms / self.bands[i][2]))
+            self.airtime_ms[i] += int(airtime_ms)
@@ -0,0 +1,254 @@
+from sx127x.clock import ticks_ms, ticks_diff, ticks_add
+
+
+# frame header: type, sequence number, sender's window base, flags.
+# ACK: type, next expected sequence, selective bitmap (2 bytes)
+TYPE_DATA = 0x10
+TYPE_ACK = 0x11
+FLAG_ACK_REQUESTED = 0x01
+DATA_HEADER_LENGTH = 4
+ACK_LENGTH = 4
+SEQ_MODULO = 256
+MAX_WINDOW = 16
+
+
+def seq_diff(a, b):
+    return (a - b) % SEQ_MODULO
+
+
+class ReliableLink:
+    """
+    Selective-repeat ARQ between two SX127x nodes.
+
+    The sender keeps up to `window` frames in flight. The receiver buffers frames
+    that arrive out of order inside the window, delivers them in sequence, drops
+    duplicates, and answers with a cumulative ACK plus a bitmap of the frames
+    received beyond it. Retransmit timers follow RFC 6298 (SRTT/RTTVAR), sampled
+    only on frames that were not retransmitted. DATA frames carry the sender's
+    window base, so the receiver skips frames the sender gave up on.
+
+    ACKs are delayed, one covers a whole burst: it goes out from service() once
+    no DATA frame arrived for ack_delay_ms, or at once after a frame flagged
+    FLAG_ACK_REQUESTED (the one filling the window, the last retransmission).
+    Nothing is transmitted from on_packet(), both ends call service() regularly.
+    ack_delay_ms has to stay well below min_rto_ms.
+    """
+
+    def __init__(self, lora, on_deliver, window = 4, max_retries = 8,
+                 initial_rto_ms = 3000, min_rto_ms = 500, max_rto_ms = 60000,
+                 ack_delay_ms = 200):
+        if not 0 < window <= MAX_WINDOW:
+            raise ValueError('window must be 1..{}'.format(MAX_WINDOW))
+        if window & (window - 1):
+            # slots are seq % window, they only stay unique across the wrap of seq if window divides 256
+            raise ValueError('window must be a power of two')
+
+        self.lora = lora
+        self.on_deliver = on_deliver        # on_deliver(payload), in sequence order
+        self.window = window
+        self.max_retries = max_retries
+        self.min_rto_ms = min_rto_ms
+        self.max_rto_ms = max_rto_ms
+        self.rto_ms = initial_rto_ms
+        self.srtt_ms = None
+        self.rttvar_ms = 0
+
+        # sender, slots indexed by seq % window
+        self.send_base = 0
+        self.next_seq = 0
+        self.tx_payloads = [None] * window
+        self.tx_sent_at = [0] * window
+        self.tx_retries = bytearray(window)
+        self.tx_acked = bytearray(window)
+
+        # receiver
+        self.recv_base = 0
+        self.rx_payloads = [None] * window
+        self.ack_delay_ms = ack_delay_ms
+        self._ack_pending = False
+        self._ack_due = 0
+
+        self.retransmissions = 0
+        self.duplicates = 0
+        self.failures = 0
+        self.skipped = 0
+
+        self._header = bytearray(DATA_HEADER_LENGTH)
+        self._ack = bytearray(ACK_LENGTH)
+
+
+    def in_flight(self):
+        return seq_diff(self.next_seq, self.send_base)
+
+
+    def send(self, payload):
+        # False when the window is full, try again after service() or an ACK.
+        if self.in_flight() >= self.window:
+            return False
+
+        seq = self.next_seq
+        slot = seq % self.window
+        self.tx_payloads[slot] = bytes(payload)
+        self.tx_retries[slot] = 0
+        self.tx_acked[slot] = 0
+        self.next_seq = (seq + 1) % SEQ_MODULO
+        # the window is full now, no more frames follow until the ACK
+        self._transmit(seq, self.in_flight() >= self.window)
+        return True
+
+
+    def _transmit(self, seq, ack_requested = False):
+        slot = seq % self.window
+        header = self._header
+        header[0] = TYPE_DATA
+        header[1] = seq
+        header[2] = self.send_base
+        header[3] = FLAG_ACK_REQUESTED if ack_requested else 0
+
+        lora = self.lora
+        lora.beginPacket()
+        lora.write(header)
+        lora.write(self.tx_payloads[slot])
+        lora.endPacket()
+        lora.receive()
+        self.tx_sent_at[slot] = ticks_ms()
+
+
+    def service(self):
+        # sends the delayed ACK and retransmits frames whose timer expired,
+        # call regularly from the main loop.
+        now = ticks_ms()
+        if self._ack_pending and ticks_diff(now, self._ack_due) >= 0:
+            self._ack_pending = False
+            self._send_ack()
+
+        # the last retransmission of this pass asks for the ACK
+        last = None
+        rto_ms = self.rto_ms
+        for i in range(self.in_flight()):
+            seq = (self.send_base + i) % SEQ_MODULO
+            slot = seq % self.window
+            if self.tx_acked[slot] or ticks_diff(now, self.tx_sent_at[slot]) < rto_ms:
+                continue
+
+            if self.tx_retries[slot] >= self.max_retries:
+                # give up on the frame, the window moves on
+                self.failures += 1
+                self.tx_acked[slot] = 1
+                continue
+
+            if last is not None:
+                self._transmit(last)
+            last = seq
+            self.tx_retries[slot] += 1
+            self.retransmissions += 1
+
+        if last is not None:
+            self.rto_ms = min(self.rto_ms * 2, self.max_rto_ms)  # back off
+            self._transmit(last, True)
+        self._advance()
+
+
+    def on_packet(self, payload):
+        # feed every received payload, returns False if it is not an ARQ frame.
+        if len(payload) >= DATA_HEADER_LENGTH and payload[0] == TYPE_DATA:
+            self._on_data(payload[1], payload[2], payload[3], memoryview(payload)[DATA_HEADER_LENGTH:])
+            return True
+        if len(payload) >= ACK_LENGTH and payload[0] == TYPE_ACK:
+            self._on_ack(payload[1], payload[2] << 8 | payload[3])
+            return True
+        return False
+
+
+    def _on_data(self, seq, send_base, flags, data):
+        ahead = seq_diff(send_base, self.recv_base)
+        if 0 < ahead < SEQ_MODULO // 2:
+            # the sender gave up on frames before send_base, deliver what arrived and move on
+            while self.recv_base != send_base:
+                slot = self.recv_base % self.window
+                payload = self.rx_payloads[slot]
+                self.rx_payloads[slot] = None
+                self.recv_base = (self.recv_base + 1) % SEQ_MODULO
+                if payload is None:
+                    self.skipped += 1
+                else:
+                    self.on_deliver(payload)
+
+        offset = seq_diff(seq, self.recv_base)
+
+        if offset < self.window:
+            slot = seq % self.window
+            if self.rx_payloads[slot] is None:
+                self.rx_payloads[slot] = bytes(data)
+            else:
+                self.duplicates += 1
+
+            # deliver everything now in sequence
+            slot = self.recv_base % self.window
+            while self.rx_payloads[slot] is not None:
+                payload = self.rx_payloads[slot]
+                self.rx_payloads[slot] = None
+                self.recv_base = (self.recv_base + 1) % SEQ_MODULO
+                self.on_deliver(payload)
+                slot = self.recv_base % self.window
+        else:
+            # already delivered, the ACK was lost
+            self.duplicates += 1
+
+        # every frame pushes the ACK back, until the burst is over or the sender asks
+        self._ack_pending = True
+        self._ack_due = ticks_add(ticks_ms(), 0 if flags & FLAG_ACK_REQUESTED else self.ack_delay_ms)
+
+
+    def _send_ack(self):
+        bitmap = 0
+        for i in range(1, self.window):
+            if self.rx_payloads[(self.recv_base + i) % self.window] is not None:
+                bitmap |= 1 << (i - 1)
+
+        ack = self._ack
+        ack[0] = TYPE_ACK
+        ack[1] = self.recv_base
+        ack[2] = (bitmap >> 8) & 0xff
+        ack[3] = bitmap & 0xff
+
+        lora = self.lora
+        lora.beginPacket()
+        lora.write(ack)
+        lora.endPacket()
+        lora.receive()
+
+
+    def _on_ack(self, next_expected, bitmap):
+        in_flight = self.in_flight()
+        acked = seq_diff(next_expected, self.send_base)
+        if acked > in_flight:
+            return  # stale
+
+        now = ticks_ms()
+        for i in range(in_flight):
+            seq = (self.send_base + i) % SEQ_MODULO
+            offset = seq_diff(seq, next_expected)
+            if i < acked or (0 < offset <= MAX_WINDOW and bitmap & (1 << (offset - 1))):
+                slot = seq % self.window
+                if not self.tx_acked[slot]:
+                    self.tx_acked[slot] = 1
+                    if self.tx_retries[slot] == 0:
+                        self._update_rto(ticks_diff(now, self.tx_sent_at[slot]))
+        self._advance()
+
+
+    def _advance(self):
+        while self.send_base != self.next_seq and self.tx_acked[self.send_base % self.window]:
+            self.tx_payloads[self.send_base % self.window] = None
+            self.send_base = (self.send_base + 1) % SEQ_MODULO
+
+
+    def _update_rto(self, rtt_ms):
+        if self.srtt_ms is None:
+            self.srtt_ms = rtt_ms
+            self.rttvar_ms = rtt_ms / 2
+        else:
+            self.rttvar_ms = 0.75 * self.rttvar_ms + 0.25 * abs(self.srtt_ms - rtt_ms)
+            self.srtt_ms = 0.875 * self.srtt_ms + 0.125 * rtt_ms
+        self.rto_ms = min(max(int(self.srtt_ms + 4 * self.rttvar_ms), self.min_rto_ms), self.max_rto_ms)
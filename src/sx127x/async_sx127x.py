@@ -0,0 +1,143 @@
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+from sx127x.clock import ticks_ms, ticks_diff
+from sx127x.ring import PacketRing
+
+
+class _ThreadSafeFlag:
+    """
+    CPython stand-in for uasyncio.ThreadSafeFlag, set() may be called from another thread.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._event = asyncio.Event()
+
+
+    def set(self):
+        loop = self._loop
+        if loop is None:
+            self._event.set()
+        else:
+            loop.call_soon_threadsafe(self._event.set)
+
+
+    async def wait(self):
+        self._loop = asyncio.get_running_loop()
+        await self._event.wait()
+        self._event.clear()
+
+
+ThreadSafeFlag = getattr(asyncio, 'ThreadSafeFlag', _ThreadSafeFlag)
+
+
+async def wait_flag(flag, timeout_ms):
+    try:
+        await asyncio.wait_for(flag.wait(), timeout_ms / 1000)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+class AsyncSX127x:
+    """
+    uasyncio / asyncio front-end for an SX127x added to a controller.
+    DIO0 interrupts wake the waiting tasks, the radio is left in receive mode between sends.
+    Received packets go through a PacketRing and are queued as Packet records,
+    so RSSI and SNR travel with the payload instead of being read after an await.
+    """
+
+    # how often to check a transmission when no DIO0 pin is wired
+    POLL_MS = 10
+
+    def __init__(self, lora, queue_size = 4, implicitHeader = False):
+        self.lora = lora
+        self.queue_size = queue_size
+        self.implicitHeader = implicitHeader
+        self.dropped = 0
+        self._queue = []
+        self._rx_flag = ThreadSafeFlag()
+        self._tx_flag = ThreadSafeFlag()
+        self._tx_success = False
+
+        if lora.rx_ring is None:
+            lora.setReceiveRing(PacketRing(queue_size))
+        lora.onPacket(self._on_packet)
+        lora.onTxDone(self._on_tx_done)
+        lora.receive()
+
+
+    def _on_packet(self, lora, packet):
+        # runs in the dispatcher, the ring slot is released when it returns
+        if len(self._queue) < self.queue_size:
+            self._queue.append(packet.copy())
+        else:
+            self.dropped += 1
+        self._rx_flag.set()
+
+
+    def _on_tx_done(self, lora, success):
+        self._tx_success = success
+        self._tx_flag.set()
+
+
+    async def send(self, buffer):
+        lora = self.lora
+
+        while not lora.poll_tx():
+            await wait_flag(self._tx_flag, self.POLL_MS)
+
+        # endPacket(wait = False) refuses to transmit before the sub-band is open
+        if lora.duty_cycle:
+            delay = lora.duty_cycle.delay_ms(lora.tuned_frequency())
+            if delay:
+                await asyncio.sleep(delay / 1000)
+
+        lora.beginPacket(self.implicitHeader)
+        lora.write(buffer)
+        lora.endPacket(wait = False)
+
+        while not lora.poll_tx():
+            await wait_flag(self._tx_flag, self.POLL_MS)
+
+        lora.receive()
+        if not self._tx_success:
+            raise Exception('TX timeout.')
+
+
+    async def recv(self, timeout_ms = None):
+        # the next Packet, None after timeout_ms.
+        start = ticks_ms()
+
+        while not self._queue:
+            if timeout_ms is None:
+                await self._rx_flag.wait()
+            else:
+                remaining = timeout_ms - ticks_diff(ticks_ms(), start)
+                if remaining <= 0 or not await wait_flag(self._rx_flag, remaining):
+                    if not self._queue:
+                        return None
+
+        return self._queue.pop(0)
+
+
+    def packets(self):
+        return _PacketIterator(self)
+
+
+class _PacketIterator:
+
+    # async generators are not available on MicroPython
+    def __init__(self, radio):
+        self.radio = radio
+
+
+    def __aiter__(self):
+        return self
+
+
+    async def __anext__(self):
+        return await self.radio.recv()
@@ -0,0 +1,164 @@
+# Sharing one SPI bus between several transceivers.
+# SpiBus serializes transactions (CS low to CS high) with a lock, IrqScheduler
+# defers DIO interrupts so they are serviced from one loop or worker thread,
+# where the lock can be waited for safely.
+
+try:
+    from _thread import allocate_lock, start_new_thread
+
+except ImportError:
+    allocate_lock = start_new_thread = None
+
+from sx127x.clock import sleep_ms
+
+
+class _NoLock:
+
+    def acquire(self, *args):
+        return True
+
+    def release(self):
+        pass
+
+
+class SpiBus:
+    """
+    An SPI bus and the lock held for each transaction on it.
+    Use SpiBus.of(spi) so every transceiver on the same SPI gets the same lock.
+
+    A single transceiver whose handlers run in interrupt context gets no lock:
+    pin IRQs and micropython.schedule callbacks run in the main thread, between
+    bytecodes, and a blocking lock taken inside a transaction would never be
+    released. The real (blocking, not reentrant) lock is only taken once a second
+    transceiver joins or a transceiver uses an IrqScheduler. From then on DIO
+    handlers must not run in interrupt context, give every transceiver on the
+    bus an IrqScheduler.
+    """
+
+    _buses = {}
+
+    def __init__(self, spi):
+        self.spi = spi
+        self.users = []
+        self.lock = _NoLock()
+        self.acquire = self.lock.acquire
+        self.release = self.lock.release
+
+        # bound once, transactions must not allocate.
+        self.write = spi.write
+        self.readinto = spi.readinto
+        self.write_readinto = spi.write_readinto
+
+
+    @classmethod
+    def of(cls, spi):
+        if spi is None or isinstance(spi, cls):
+            return spi
+        bus = cls._buses.get(id(spi))
+        if bus is None:
+            bus = cls._buses[id(spi)] = cls(spi)
+        return bus
+
+
+    def join(self, user):
+        # called by each transceiver on the bus, the second one turns the lock on.
+        if user not in self.users:
+            self.users.append(user)
+        if len(self.users) > 1:
+            self.use_lock()
+
+
+    def use_lock(self):
+        # outside of any transaction only.
+        if isinstance(self.lock, _NoLock) and allocate_lock:
+            self.lock = allocate_lock()
+            self.acquire = self.lock.acquire
+            self.release = self.lock.release
+
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+
+    def __exit__(self, *args):
+        self.release()
+
+
+    def deinit(self):
+        self._buses.pop(id(self.spi), None)
+        self.spi.deinit()
+
+
+class IrqScheduler:
+    """
+    Services the DIO interrupts of several transceivers in turn.
+
+    Set it as lora.irq_scheduler before the handlers are attached: the interrupt
+    then only marks the handler pending, and service() runs pending handlers
+    round-robin, starting after the last one it ran, so a busy radio cannot
+    starve the others. Call service() from the main loop, or start() a worker.
+    Handlers must not run in interrupt context once radios share a bus, an
+    interrupt taken during another radio's transaction would wait on the lock forever.
+    """
+
+    def __init__(self):
+        self.handlers = []
+        self.pins = []
+        self.pending = bytearray(0)
+        self._next = 0
+        self.running = False
+        self.serviced = 0
+
+
+    def defer(self, pin, method):
+        # returns the IRQ handler standing in for method on pin.
+        for i in range(len(self.handlers)):
+            if self.pins[i] is pin:
+                self.handlers[i] = method
+                break
+        else:
+            i = len(self.handlers)
+            self.handlers.append(method)
+            self.pins.append(pin)
+            self.pending.append(0)
+
+        pending = self.pending
+
+        def handler(event_source):
+            pending[i] = 1
+
+        return handler
+
+
+    def service(self):
+        # runs each pending handler once, returns how many ran.
+        count = len(self.handlers)
+        start = self._next
+        ran = 0
+        for n in range(count):
+            i = (start + n) % count
+            if self.pending[i]:
+                self.pending[i] = 0
+                self.handlers[i](self.pins[i])
+                ran += 1
+                self._next = (i + 1) % count
+        self.serviced += ran
+        return ran
+
+
+    def run(self, idle_ms = 1):
+        self.running = True
+        while self.running:
+            if not self.service():
+                sleep_ms(idle_ms)
+
+
+    def start(self, idle_ms = 1):
+        if start_new_thread is None:
+            raise Exception('No threads, call service() from the main loop.')
+        start_new_thread(self.run, (idle_ms,))
+
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,57 @@
+FXOSC = 32000000
+FSTEP_SHIFT = 19    # Fstep = FXOSC / 2^19, about 61 Hz
+
+
+def frf(frequency):
+    """
+    The three RegFrf bytes (MSB first) for a frequency in Hz.
+    """
+
+    value = ((int(frequency) << FSTEP_SHIFT) + FXOSC // 2) // FXOSC
+    return bytes(((value >> 16) & 0xff, (value >> 8) & 0xff, value & 0xff))
+
+
+def frequency_from_frf(frf):
+    return ((frf[0] << 16 | frf[1] << 8 | frf[2]) * FXOSC) >> FSTEP_SHIFT
+
+
+class ChannelPlan:
+    """
+    A list of channel frequencies in Hz with their RegFrf bytes precomputed,
+    so that retuning to a channel is a single 3-byte burst.
+    """
+
+    def __init__(self, frequencies, name = None):
+        self.name = name
+        self.frequencies = tuple(int(f) for f in frequencies)
+        self.frfs = tuple(frf(f) for f in self.frequencies)
+
+
+    def __len__(self):
+        return len(self.frequencies)
+
+
+    def index(self, frequency):
+        return self.frequencies.index(int(frequency))
+
+
+    @classmethod
+    def uniform(cls, first, spacing, count, name = None):
+        return cls([first + spacing * i for i in range(count)], name)
+
+
+def us915():
+    # 64 upstream channels of 125 kHz, then 8 of 500 kHz (channels 64-71).
+    return ChannelPlan([902300000 + 200000 * i for i in range(64)] +
+                       [903000000 + 1600000 * i for i in range(8)], 'US915')
+
+
+def eu868():
+    # the three mandatory LoRaWAN channels, then the usual 867.1-867.9 MHz additions.
+    return ChannelPlan([868100000, 868300000, 868500000,
+                        867100000, 867300000, 867500000, 867700000, 867900000], 'EU868')
+
+
+def as923():
+    return ChannelPlan([923200000, 923400000,
+                        922200000, 922400000, 922600000, 922800000, 923000000, 922000000], 'AS923')
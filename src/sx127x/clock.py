@@ -0,0 +1,29 @@
+# MicroPython's wrap-around tick counters, with equivalents for CPython.
+
+try:
+    from time import ticks_ms, ticks_us, ticks_diff, ticks_add, sleep_ms
+
+except ImportError:
+    from time import monotonic, sleep
+
+    def ticks_ms():
+        return int(monotonic() * 1000)
+
+    def ticks_us():
+        return int(monotonic() * 1000000)
+
+    def ticks_diff(ticks1, ticks2):
+        return ticks1 - ticks2
+
+    def ticks_add(ticks, delta):
+        return ticks + delta
+
+    def sleep_ms(ms):
+        sleep(ms / 1000)
+
+
+# sleep that lets the MCU power down, woken early by pin interrupts.
+try:
+    from machine import lightsleep as lightsleep_ms
+except ImportError:
+    lightsleep_ms = sleep_ms
@@ -1,10 +1,14 @@
 import sys
 import os 
-import time
 
+from sx127x.clock import ticks_ms
 
-import machine
-import ubinascii
+if sys.implementation.name == 'micropython':
+    import machine
+    import ubinascii
+
+else:
+    from uuid import getnode
 
 CONFIG = None
 
@@ -42,8 +46,13 @@ class Configuration:
     def __init__(self):
 
         # Node Name
-        uuid = ubinascii.hexlify(machine.unique_id()).decode()
+        if self.IS_MICROPYTHON:
+            uuid = ubinascii.hexlify(machine.unique_id()).decode()
+        else:
+            uuid = '{:012x}'.format(getnode())
 
+        if self.IS_RPI:
+            self.NODE_NAME = 'Linux_'
         if self.IS_ESP8266:
             self.NODE_NAME = 'ESP8266_'
         if self.IS_ESP32:
@@ -53,11 +62,14 @@ class Configuration:
         self.NODE_NAME = self.NODE_NAME + uuid
 
         # millisecond
-        self.MILLISECOND = time.ticks_ms
+        self.MILLISECOND = ticks_ms
 
         # Controller
         self.SOFT_SPI = None
-        if self.IS_TTGO_LORA_OLED:
+        if self.IS_RPI:
+            from sx127x.controller.linux_controller import LinuxController
+            self.CONTROLLER = LinuxController
+        elif self.IS_TTGO_LORA_OLED:
             from sx127x.controller.controller_esp_ttgo_lora_oled import TTGOController
             self.SOFT_SPI = True
             self.CONTROLLER = TTGOController
@@ -1,4 +1,5 @@
 from time import sleep
+from sx127x.bus import SpiBus
 
 
 class BaseController:
@@ -26,13 +27,16 @@ class BaseController:
                  pin_id_led = ON_BOARD_LED_PIN_NO, 
                  on_board_led_high_is_on = ON_BOARD_LED_HIGH_IS_ON,
                  pin_id_reset = LORA_RESET,
-                 blink_on_start = (2, 0.5, 0.5)):                 
+                 blink_on_start = (2, 0.5, 0.5),
+                 irq_scheduler = None):                 
 
         self.pin_led = self.prepare_pin(pin_id_led)
         self.on_board_led_high_is_on = on_board_led_high_is_on
         self.pin_reset = self.prepare_pin(pin_id_reset)        
         self.reset_pin(self.pin_reset)
-        self.spi = self.prepare_spi(self.get_spi())        
+        self.spi = SpiBus.of(self.prepare_spi(self.get_spi()))
+        # an IrqScheduler, required when several transceivers share the bus, see SpiBus
+        self.irq_scheduler = irq_scheduler
         self.transceivers = {}
         self.blink_led(*blink_on_start) 
         
@@ -48,7 +52,9 @@ class BaseController:
                         pin_id_PayloadCrcError = LORA_DIO5):
         
         transceiver.blink_led = self.blink_led
-        transceiver.pin_ss = self.prepare_pin(pin_id_ss)
+        transceiver.spi = SpiBus.of(transceiver.spi or self.spi)
+        transceiver.irq_scheduler = self.irq_scheduler
+        transceiver.pin_ss = self.prepare_ss_pin(pin_id_ss)
         transceiver.pin_RxDone = self.prepare_irq_pin(pin_id_RxDone)
         transceiver.pin_RxTimeout = self.prepare_irq_pin(pin_id_RxTimeout)
         transceiver.pin_ValidHeader = self.prepare_irq_pin(pin_id_ValidHeader)
@@ -73,6 +79,10 @@ class BaseController:
         raise NotImplementedError('reason')
         
 
+    def prepare_ss_pin(self, pin_id):
+        return self.prepare_pin(pin_id)
+
+
     def prepare_irq_pin(self, pin_id):
         reason = '''
             # a irq_pin should provide:
@@ -45,12 +45,14 @@ class TTGOController(esp_controller.ESP32Controller):
                  oled_height = OLED_HEIGHT,
                  scl_pin_id = OLED_SCL,
                  sda_pin_id = OLED_SDA,
-                 freq = OLED_I2C_FREQ):
+                 freq = OLED_I2C_FREQ,
+                 irq_scheduler = None):
 
         super().__init__(pin_id_led = pin_id_led,
                          on_board_led_high_is_on = on_board_led_high_is_on,
                          pin_id_reset = pin_id_reset,
-                         blink_on_start = blink_on_start)
+                         blink_on_start = blink_on_start,
+                         irq_scheduler = irq_scheduler)
 
         self.reset_pin(self.prepare_pin(self.OLED_RESET))
         self.display = display_ssd1306_i2c.Display(
@@ -74,12 +74,14 @@ class ESP32Controller(ESPController):
                  pin_id_led = ON_BOARD_LED_PIN_NO,
                  on_board_led_high_is_on = ON_BOARD_LED_HIGH_IS_ON,
                  pin_id_reset = LORA_RESET,
-                 blink_on_start = (2, 0.5, 0.5)):
+                 blink_on_start = (2, 0.5, 0.5),
+                 irq_scheduler = None):
                 
         super().__init__(pin_id_led,
                          on_board_led_high_is_on,
                          pin_id_reset,
-                         blink_on_start)
+                         blink_on_start,
+                         irq_scheduler)
 
 
     def get_spi(self): 
@@ -132,12 +134,14 @@ class ESP8266Controller(ESPController):
                  pin_id_led = ON_BOARD_LED_PIN_NO,
                  on_board_led_high_is_on = ON_BOARD_LED_HIGH_IS_ON,
                  pin_id_reset = LORA_RESET,
-                 blink_on_start = (2, 0.5, 0.5)):
+                 blink_on_start = (2, 0.5, 0.5),
+                 irq_scheduler = None):
 
         super().__init__(pin_id_led,
                          on_board_led_high_is_on,
                          pin_id_reset,
-                         blink_on_start)
+                         blink_on_start,
+                         irq_scheduler)
 
 
     def get_spi(self):
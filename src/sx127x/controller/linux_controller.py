@@ -0,0 +1,328 @@
+# Controller for Linux single board computers (Raspberry Pi and alike).
+# SPI goes through spidev, pins through the GPIO character device (libgpiod),
+# DIO interrupts are delivered by a thread per pin waiting on line events.
+# FakeSpiDev and FakeGpio stand in for both, so it runs on any Linux box.
+
+from _thread import allocate_lock
+from threading import Thread, current_thread
+
+from sx127x.controller import base_controller
+
+
+class SpidevSpi:
+    """
+    The driver's SPI calls on top of spidev.
+    Bytes are collected while CS is low and go out in a single xfer2,
+    a read flushes what was written before it in the same transaction.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self._pending = []
+
+
+    def write(self, buffer):
+        self._pending.extend(buffer)
+
+
+    def readinto(self, buffer, write = 0x00):
+        self.write_readinto(bytes([write]) * len(buffer), buffer)
+
+
+    def write_readinto(self, out, into):
+        skip = len(self._pending)
+        self._pending.extend(out)
+        data = self.device.xfer2(self._pending)
+        self._pending = []
+        into[:] = bytes(data[skip:])
+
+
+    def flush(self):
+        if self._pending:
+            self.device.xfer2(self._pending)
+            self._pending = []
+
+
+    def deinit(self):
+        self.device.close()
+
+
+class ChipSelectPin:
+    """
+    Chip select of a transceiver, ends the spidev transaction when released.
+    Without a GPIO line the spidev device's own CS is used.
+    """
+
+    def __init__(self, spi, pin = None):
+        self.spi = spi
+        self.pin = pin
+
+
+    def value(self, value = None):
+        if value is None:
+            return self.pin.value() if self.pin else 1
+        if value:
+            self.spi.flush()
+        if self.pin:
+            self.pin.value(value)
+
+
+class GpiodPin:
+    """
+    A GPIO line. The first irq() handler starts one event thread that lives as
+    long as the pin, later irq() calls only swap the handler it runs.
+    """
+
+    def __init__(self, line):
+        self.line = line
+        self._handler = None
+        self._thread = None
+        self._closed = False
+        self._lock = allocate_lock()
+
+
+    def value(self, value = None):
+        if value is None:
+            return self.line.get_value()
+        self.line.set_value(1 if value else 0)
+
+
+    def irq(self, handler = None, trigger = 0):
+        with self._lock:
+            self._handler = handler
+            if handler and self._thread is None and not self._closed:
+                self._thread = Thread(target = self._wait_events, daemon = True)
+                self._thread.start()
+
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._handler = None
+            thread = self._thread
+        if thread and thread is not current_thread():
+            thread.join()
+        self.line.release()
+
+
+    def _wait_events(self):
+        while not self._closed:
+            if self.line.event_wait(sec = 0, nsec = 100000000):
+                self.line.event_read()
+                # edges without a handler are read and dropped
+                handler = self._handler
+                if handler:
+                    handler(self)
+
+
+class GpiodBackend:
+    """
+    GPIO lines from /dev/gpiochipN, through the libgpiod (1.x) python bindings.
+    """
+
+    def __init__(self, chip = '/dev/gpiochip0', consumer = 'sx127x'):
+        import gpiod
+        self.gpiod = gpiod
+        self.chip = gpiod.Chip(chip)
+        self.consumer = consumer
+        self.pins = []
+
+
+    def output(self, pin_id):
+        line = self.chip.get_line(pin_id)
+        line.request(consumer = self.consumer, type = self.gpiod.LINE_REQ_DIR_OUT, default_vals = [1])
+        return self._pin(line)
+
+
+    def input(self, pin_id):
+        line = self.chip.get_line(pin_id)
+        line.request(consumer = self.consumer, type = self.gpiod.LINE_REQ_EV_RISING_EDGE)
+        return self._pin(line)
+
+
+    def _pin(self, line):
+        pin = GpiodPin(line)
+        self.pins.append(pin)
+        return pin
+
+
+    def close(self):
+        # stops the event threads before the lines go away
+        for pin in self.pins:
+            pin.close()
+        self.pins = []
+        self.chip.close()
+
+
+class FakeSpiDev:
+    """
+    Stands in for spidev.SpiDev. Each xfer2 is handed to device.transfer(data)
+    as one CS framed transaction, zeros are read back without a device.
+    """
+
+    def __init__(self, device = None):
+        self.device = device
+        self.max_speed_hz = 0
+        self.mode = 0
+        self.lsbfirst = False
+        self.transfers = 0
+        self.bytes = 0
+
+
+    def open(self, bus, device):
+        pass
+
+
+    def xfer2(self, data):
+        self.transfers += 1
+        self.bytes += len(data)
+        if self.device is None:
+            return [0] * len(data)
+        return list(self.device.transfer(bytes(data)))
+
+
+    def close(self):
+        pass
+
+
+class FakePin:
+
+    def __init__(self, pin_id):
+        self.pin_id = pin_id
+        self._value = 0
+        self.handler = None
+
+
+    def value(self, value = None):
+        if value is None:
+            return self._value
+        self._value = 1 if value else 0
+
+
+    def irq(self, handler = None, trigger = 0):
+        self.handler = handler
+
+
+    def pulse(self):
+        # a rising edge, the handler runs in the calling thread.
+        self._value = 1
+        if self.handler:
+            self.handler(self)
+        self._value = 0
+
+
+class FakeGpio:
+
+    def __init__(self):
+        self.pins = {}
+
+
+    def output(self, pin_id):
+        return self.pins.setdefault(pin_id, FakePin(pin_id))
+
+
+    def input(self, pin_id):
+        return self.pins.setdefault(pin_id, FakePin(pin_id))
+
+
+    def close(self):
+        pass
+
+
+class LinuxController(base_controller.BaseController):
+
+    # LoRa config, BCM GPIO numbers
+    LORA_RESET = 22
+
+    LORA_CS = 25
+    LORA_SCK = 11
+    LORA_MOSI = 10
+    LORA_MISO = 9
+
+    LORA_DIO0 = 17
+    LORA_DIO1 = None
+    LORA_DIO2 = None
+    LORA_DIO3 = None
+    LORA_DIO4 = None
+    LORA_DIO5 = None
+
+    # spidev config, /dev/spidev0.0
+    SPI_BUS = 0
+    SPI_DEVICE = 0
+    SPI_SPEED = 10000000
+
+    ON_BOARD_LED_PIN_NO = None
+    ON_BOARD_LED_HIGH_IS_ON = True
+
+
+    def __init__(self,
+                 pin_id_led = ON_BOARD_LED_PIN_NO,
+                 on_board_led_high_is_on = ON_BOARD_LED_HIGH_IS_ON,
+                 pin_id_reset = LORA_RESET,
+                 blink_on_start = (2, 0.5, 0.5),
+                 irq_scheduler = None,
+                 spi_bus = SPI_BUS,
+                 spi_device = SPI_DEVICE,
+                 spi_speed = SPI_SPEED,
+                 spidev = None,
+                 gpio = None):
+
+        # spidev.SpiDev and GpiodBackend unless fakes are passed in
+        self.spi_bus = spi_bus
+        self.spi_device = spi_device
+        self.spi_speed = spi_speed
+        self.spidev = spidev
+        self.gpio = gpio or GpiodBackend()
+
+        super().__init__(pin_id_led,
+                         on_board_led_high_is_on,
+                         pin_id_reset,
+                         blink_on_start,
+                         irq_scheduler)
+
+
+    def prepare_pin(self, pin_id, in_out = None):
+        if pin_id is not None:
+            return self.gpio.output(pin_id)
+        return None
+
+
+    def prepare_ss_pin(self, pin_id):
+        return ChipSelectPin(self.spi.spi, self.prepare_pin(pin_id))
+
+
+    def prepare_irq_pin(self, pin_id):
+        if pin_id is not None:
+            return self.gpio.input(pin_id)
+        return None
+
+
+    def get_spi(self):
+        if self.spidev is None:
+            import spidev
+            self.spidev = spidev.SpiDev()
+
+        self.spidev.open(self.spi_bus, self.spi_device)
+        self.spidev.max_speed_hz = self.spi_speed
+        self.spidev.mode = 0b00
+        self.spidev.lsbfirst = False
+        return self.spidev
+
+
+    def prepare_spi(self, spi):
+        return SpidevSpi(spi)
+
+
+    def led_on(self, on = True):
+        if self.pin_led:
+            super().led_on(on)
+
+
+    def blink_led(self, times = 1, on_seconds = 0.1, off_seconds = 0.1):
+        if self.pin_led:
+            super().blink_led(times, on_seconds, off_seconds)
+
+
+    def __exit__(self):
+        self.spi.deinit()
+        self.gpio.close()
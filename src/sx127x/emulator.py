@@ -0,0 +1,336 @@
+# Register level SX127x (LoRa mode) emulator, for running the driver without hardware.
+# It is the SPI bus and the pins of one chip:
+#
+#   chip = Emulator()
+#   lora = chip.attach(SX127x('915E6', chip))
+#
+# TX completes at once, RX and CAD results are injected with receive() and
+# activity, linked emulators hear each other's transmissions. DIO pins rise
+# with the IRQ flags they are mapped to, handlers are run through schedule()
+# or, with schedule set to None, queued until fire() for deterministic runs.
+
+from sx127x.bus import SpiBus
+from sx127x.channels import frequency_from_frf
+from sx127x.schedule import schedule
+
+
+class Pin:
+    """
+    A DIO line, its level follows the IRQ flags mapped onto it.
+    """
+
+    def __init__(self, chip, dio):
+        self.chip = chip
+        self.dio = dio
+        self.handler = None
+
+
+    def value(self, value = None):
+        if value is None:
+            return self.chip.dio_level(self.dio)
+
+
+    def irq(self, handler = None, trigger = 0):
+        self.handler = handler
+
+
+class ChipSelectPin:
+
+    def __init__(self, chip):
+        self.chip = chip
+
+
+    def value(self, value = None):
+        if value is None:
+            return 0 if self.chip.selected else 1
+        if value:
+            self.chip.deselect()
+        else:
+            self.chip.select()
+
+
+class Emulator:
+
+    MODE_SLEEP = 0x00
+    MODE_STDBY = 0x01
+    MODE_TX = 0x03
+    MODE_RX_CONTINUOUS = 0x05
+    MODE_RX_SINGLE = 0x06
+    MODE_CAD = 0x07
+
+    IRQ_RX_TIMEOUT = 0x80
+    IRQ_RX_DONE = 0x40
+    IRQ_PAYLOAD_CRC_ERROR = 0x20
+    IRQ_VALID_HEADER = 0x10
+    IRQ_TX_DONE = 0x08
+    IRQ_CAD_DONE = 0x04
+    IRQ_FHSS_CHANGE_CHANNEL = 0x02
+    IRQ_CAD_DETECTED = 0x01
+
+    # IRQ flag behind each DIO mapping, (dio, mapping) -> flag
+    DIO_FLAGS = {(0, 0): IRQ_RX_DONE, (0, 1): IRQ_TX_DONE, (0, 2): IRQ_CAD_DONE,
+                 (1, 0): IRQ_RX_TIMEOUT, (1, 1): IRQ_FHSS_CHANGE_CHANNEL, (1, 2): IRQ_CAD_DETECTED,
+                 (2, 0): IRQ_FHSS_CHANGE_CHANNEL, (2, 1): IRQ_FHSS_CHANGE_CHANNEL, (2, 2): IRQ_FHSS_CHANGE_CHANNEL,
+                 (3, 0): IRQ_CAD_DONE, (3, 1): IRQ_VALID_HEADER, (3, 2): IRQ_PAYLOAD_CRC_ERROR,
+                 (4, 0): IRQ_CAD_DETECTED}
+
+    # registers the chip updates itself, writes are ignored
+    READ_ONLY = (0x10, 0x13, 0x14, 0x15, 0x16, 0x17, 0x18, 0x19, 0x1a, 0x1b, 0x1c,
+                 0x25, 0x28, 0x29, 0x2a, 0x42)
+
+    # LoRa mode reset values, others are 0x00
+    RESET_VALUES = {0x01: 0x09, 0x06: 0x6c, 0x07: 0x80, 0x09: 0x4f, 0x0a: 0x09, 0x0b: 0x2b,
+                    0x0c: 0x20, 0x0e: 0x80, 0x18: 0x10, 0x1d: 0x72, 0x1e: 0x70, 0x1f: 0x64,
+                    0x21: 0x08, 0x22: 0x01, 0x23: 0xff, 0x26: 0x04, 0x31: 0xc3, 0x33: 0x27,
+                    0x37: 0x0a, 0x39: 0x12, 0x42: 0x12, 0x4d: 0x84}
+
+
+    def __init__(self, rssi = -60, snr = 8.0):
+        self.rssi = rssi
+        self.snr = snr
+        self.activity = False   # CAD detects a preamble
+        self.schedule = schedule
+        self.pin_ss = ChipSelectPin(self)
+        self.dio = [Pin(self, i) for i in range(6)]
+        self.peers = []
+
+        # counters
+        self.transactions = 0
+        self.bytes = 0
+        self.transmitted = []
+        self.missed = 0
+
+        self.pending = []
+        self.reset()
+
+
+    def reset(self):
+        self.regs = bytearray(0x80)
+        for address, value in self.RESET_VALUES.items():
+            self.regs[address] = value
+        self.fifo = bytearray(256)
+        self.selected = False
+        self._address = None
+        self._write = False
+        self._rx_address = 0
+        self._levels = [0] * 6
+
+
+    def attach(self, lora):
+        # wires lora up the way a controller's add_transceiver() does.
+        lora.spi = lora.spi or SpiBus.of(self)
+        lora.pin_ss = self.pin_ss
+        lora.pin_RxDone = self.dio[0]
+        lora.pin_RxTimeout = self.dio[1]
+        lora.pin_ValidHeader = self.dio[2]
+        lora.pin_CadDone = self.dio[3]
+        lora.pin_CadDetected = self.dio[4]
+        lora.pin_PayloadCrcError = self.dio[5]
+        lora.init()
+        return lora
+
+
+    def link(self, other):
+        self.peers.append(other)
+        other.peers.append(self)
+
+
+    # SPI
+
+    def select(self):
+        if self.selected:
+            raise Exception('Chip already selected.')
+        self.selected = True
+        self._address = None
+        self.transactions += 1
+
+
+    def deselect(self):
+        self.selected = False
+        self._update_dio()
+
+
+    def write(self, buffer):
+        for b in buffer:
+            self._byte(b)
+
+
+    def readinto(self, buffer, write = 0x00):
+        for i in range(len(buffer)):
+            buffer[i] = self._byte(write)
+
+
+    def write_readinto(self, out, into):
+        for i in range(len(out)):
+            into[i] = self._byte(out[i])
+
+
+    def transfer(self, data):
+        # one CS framed transaction, for FakeSpiDev.
+        self.select()
+        into = bytearray(len(data))
+        self.write_readinto(data, into)
+        self.deselect()
+        return into
+
+
+    def deinit(self):
+        pass
+
+
+    def _byte(self, b):
+        if not self.selected:
+            raise Exception('SPI access without chip select.')
+        self.bytes += 1
+
+        if self._address is None:
+            self._address = b & 0x7f
+            self._write = (b & 0x80) != 0
+            return 0
+
+        address = self._address
+        regs = self.regs
+        if address == 0x00:
+            # FIFO, through the FIFO pointer instead of the address
+            pointer = regs[0x0d]
+            value = self.fifo[pointer]
+            if self._write:
+                self.fifo[pointer] = b
+            regs[0x0d] = (pointer + 1) & 0xff
+            return value
+
+        value = regs[address]
+        if self._write:
+            self._write_register(address, b)
+        self._address = (address + 1) & 0x7f
+        return value
+
+
+    def _write_register(self, address, value):
+        if address == 0x12:
+            self.regs[0x12] &= ~value & 0xff
+        elif address == 0x01:
+            self._set_mode(value)
+        elif address not in self.READ_ONLY:
+            self.regs[address] = value
+
+
+    # modem
+
+    def _set_mode(self, value):
+        previous = self.regs[0x01]
+        if previous & 0x07 != self.MODE_SLEEP:
+            # LongRangeMode only changes in sleep
+            value = (value & 0x7f) | (previous & 0x80)
+        self.regs[0x01] = value
+        mode = value & 0x07
+
+        if mode == self.MODE_SLEEP:
+            self.fifo[:] = bytes(256)  # FIFO is cleared in sleep
+        elif mode == self.MODE_TX:
+            self._transmit()
+        elif mode in (self.MODE_RX_CONTINUOUS, self.MODE_RX_SINGLE):
+            if previous & 0x07 not in (self.MODE_RX_CONTINUOUS, self.MODE_RX_SINGLE):
+                self._rx_address = self.regs[0x0f]
+        elif mode == self.MODE_CAD:
+            self._set_flags(self.IRQ_CAD_DONE | (self.IRQ_CAD_DETECTED if self.activity else 0))
+            self._standby()
+
+
+    def _standby(self):
+        self.regs[0x01] = (self.regs[0x01] & 0xf8) | self.MODE_STDBY
+
+
+    def _set_flags(self, flags):
+        self.regs[0x12] |= flags & ~self.regs[0x11]
+
+
+    def _transmit(self):
+        start = self.regs[0x0e]
+        payload = bytes(self.fifo[(start + i) & 0xff] for i in range(self.regs[0x22]))
+        self.transmitted.append(payload)
+        self._set_flags(self.IRQ_TX_DONE)
+        self._standby()
+
+        for peer in self.peers:
+            if peer.regs[0x06:0x09] == self.regs[0x06:0x09] and \
+               peer.regs[0x1d] >> 4 == self.regs[0x1d] >> 4 and \
+               peer.regs[0x1e] >> 4 == self.regs[0x1e] >> 4 and \
+               peer.regs[0x39] == self.regs[0x39]:
+                peer.receive(payload)
+
+
+    def receive(self, payload, rssi = None, snr = None, crc_ok = True, freq_error = 0):
+        # a packet arrives over the air, False if the chip was not listening.
+        regs = self.regs
+        mode = regs[0x01] & 0x07
+        if mode not in (self.MODE_RX_CONTINUOUS, self.MODE_RX_SINGLE):
+            self.missed += 1
+            return False
+
+        if regs[0x1d] & 0x01:
+            # implicit header, the length is configured, not received
+            payload = bytes(payload[:regs[0x22]]) + bytes(max(regs[0x22] - len(payload), 0))
+
+        start = self._rx_address
+        for i in range(len(payload)):
+            self.fifo[(start + i) & 0xff] = payload[i]
+        self._rx_address = (start + len(payload)) & 0xff
+
+        rssi = self.rssi if rssi is None else rssi
+        snr = self.snr if snr is None else snr
+        regs[0x10] = start
+        regs[0x13] = len(payload)
+        regs[0x25] = self._rx_address
+        regs[0x19] = int(snr * 4) & 0xff
+        # RSSI registers are offset by 164 on the low frequency port, 157 on the high one
+        offset = 164 if frequency_from_frf(regs[0x06:0x09]) < 868000000 else 157
+        regs[0x1a] = regs[0x1b] = max(min(rssi + offset, 0xff), 0)
+        freq_error &= 0xfffff
+        regs[0x28] = freq_error >> 16
+        regs[0x29] = (freq_error >> 8) & 0xff
+        regs[0x2a] = freq_error & 0xff
+
+        self._set_flags(self.IRQ_VALID_HEADER | self.IRQ_RX_DONE |
+                        (0 if crc_ok else self.IRQ_PAYLOAD_CRC_ERROR))
+        if mode == self.MODE_RX_SINGLE:
+            self._standby()
+
+        if not self.selected:
+            self._update_dio()
+        return True
+
+
+    # DIO
+
+    def dio_level(self, dio):
+        if dio < 4:
+            mapping = (self.regs[0x40] >> (6 - 2 * dio)) & 0x03
+        else:
+            mapping = (self.regs[0x41] >> (14 - 2 * dio)) & 0x03
+        flag = self.DIO_FLAGS.get((dio, mapping), 0)
+        return 1 if self.regs[0x12] & flag else 0
+
+
+    def _update_dio(self):
+        for dio in range(6):
+            level = self.dio_level(dio)
+            if level and not self._levels[dio]:
+                pin = self.dio[dio]
+                if pin.handler:
+                    if self.schedule:
+                        self.schedule(pin.handler, pin)
+                    else:
+                        self.pending.append(pin)
+            self._levels[dio] = level
+
+
+    def fire(self):
+        # runs the queued DIO handlers, when schedule is None.
+        count = 0
+        while self.pending:
+            pin = self.pending.pop(0)
+            if pin.handler:
+                pin.handler(pin)
+                count += 1
+        return count
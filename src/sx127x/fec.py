@@ -0,0 +1,242 @@
+# Cross-packet erasure codes: systematic Reed-Solomon over GF(256) with a Cauchy generator.
+# A block of K data packets is followed by R repair packets, any K of the K + R
+# packets rebuild the block.
+
+# GF(256) with the polynomial x^8 + x^4 + x^3 + x^2 + 1 (0x11d), tables built at import.
+GF_EXP = bytearray(512)
+GF_LOG = bytearray(256)
+
+_x = 1
+for _i in range(255):
+    GF_EXP[_i] = _x
+    GF_LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11d
+for _i in range(255, 512):
+    GF_EXP[_i] = GF_EXP[_i - 255]
+del _x, _i
+
+
+def gf_mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return GF_EXP[GF_LOG[a] + GF_LOG[b]]
+
+
+def gf_inv(a):
+    return GF_EXP[255 - GF_LOG[a]]
+
+
+def gf_mul_row(c):
+    # c * x for every byte x, turns a symbol multiply into one lookup per byte
+    row = bytearray(256)
+    if c:
+        log_c = GF_LOG[c]
+        for x in range(1, 256):
+            row[x] = GF_EXP[log_c + GF_LOG[x]]
+    return row
+
+
+def cauchy(k, j, i):
+    # coefficient of data packet i in repair packet j
+    return gf_inv((k + j) ^ i)
+
+
+def _add_scaled(acc, src, row):
+    for n in range(len(src)):
+        acc[n] ^= row[src[n]]
+
+
+# packet header: block id, index (data 0..K-1, repair K..K+R-1), K, R
+HEADER_LENGTH = 4
+MAX_FRAME_LENGTH = 255
+MAX_DATA_LENGTH = MAX_FRAME_LENGTH - HEADER_LENGTH - 1  # repair frames carry a length byte more
+
+
+class FecEncoder:
+    """
+    Builds the R repair packets of a block of K data packets.
+    A data symbol is its length byte followed by the data, zero padded to the longest packet.
+    """
+
+    def __init__(self, k, r):
+        if k + r > 255:
+            raise ValueError('K + R must not exceed 255.')
+        self.k = k
+        self.r = r
+        self.block_id = 0
+        self.rows = [[gf_mul_row(cauchy(k, j, i)) for i in range(k)] for j in range(r)]
+
+
+    def encode(self, packets):
+        if len(packets) != self.k:
+            raise ValueError('A block has {} packets.'.format(self.k))
+        for packet in packets:
+            if len(packet) > MAX_DATA_LENGTH:
+                raise ValueError('Data packets are at most {} bytes.'.format(MAX_DATA_LENGTH))
+
+        size = max(len(p) for p in packets) + 1
+        repairs = [bytearray(size) for j in range(self.r)]
+        symbol = bytearray(size)
+        for i in range(self.k):
+            packet = packets[i]
+            symbol[0] = len(packet)
+            symbol[1: len(packet) + 1] = packet
+            for n in range(len(packet) + 1, size):
+                symbol[n] = 0
+            for j in range(self.r):
+                _add_scaled(repairs[j], symbol, self.rows[j][i])
+        return repairs
+
+
+    def frames(self, packets):
+        # the K data packets then the R repair packets, each with its header
+        self.block_id = (self.block_id + 1) & 0xff
+        repairs = self.encode(packets)
+        for i in range(self.k):
+            yield bytes((self.block_id, i, self.k, self.r)) + bytes(packets[i])
+        for j in range(self.r):
+            yield bytes((self.block_id, self.k + j, self.k, self.r)) + repairs[j]
+
+
+    def send(self, lora, packets):
+        for frame in self.frames(packets):
+            lora.beginPacket()
+            lora.write(frame)
+            lora.endPacket()
+
+
+class FecDecoder:
+    """
+    Collects the packets of one block at a time and rebuilds missing data packets
+    from the repair packets, without a round trip. Frames that do not agree with
+    the block, its K and R, the repair size or the data lengths it allows, are dropped.
+    """
+
+    # multiply rows of the Cauchy coefficients kept, 256 bytes each
+    ROW_CACHE_SIZE = 32
+
+    def __init__(self):
+        self.block_id = None
+        self.decoded = 0
+        self.recovered = 0
+        self.failures = 0   # blocks abandoned with too few packets
+        self.dropped = 0    # inconsistent frames
+        self._rows = {}
+
+
+    def _reset(self, block_id, k, r):
+        if self.block_id is not None and not self.done:
+            self.failures += 1
+        self.block_id = block_id
+        self.k = k
+        self.r = r
+        self.data = [None] * k
+        self.repairs = {}
+        self.size = None    # repair symbol size, set by the first repair packet
+        self.longest = 0    # longest data packet so far
+        self.done = False
+
+
+    def feed(self, payload):
+        """
+        Returns the block's K data packets, in order, once it can be rebuilt, None otherwise.
+        """
+
+        if len(payload) < HEADER_LENGTH:
+            return None
+        block_id, index, k, r = payload[0], payload[1], payload[2], payload[3]
+        if k == 0 or k + r > 255 or index >= k + r:
+            self.dropped += 1
+            return None
+        if block_id != self.block_id:
+            self._reset(block_id, k, r)
+        elif k != self.k or r != self.r:
+            self.dropped += 1
+            return None
+        if self.done:
+            return None
+
+        length = len(payload) - HEADER_LENGTH
+        if index < k:
+            if length > MAX_DATA_LENGTH or (self.size is not None and length >= self.size):
+                self.dropped += 1
+                return None
+            self.data[index] = bytes(memoryview(payload)[HEADER_LENGTH:])
+            self.longest = max(self.longest, length)
+        else:
+            if length <= self.longest or (self.size is not None and length != self.size):
+                self.dropped += 1
+                return None
+            self.size = length
+            self.repairs[index - k] = bytes(memoryview(payload)[HEADER_LENGTH:])
+
+        have = k - self.data.count(None)
+        if have + len(self.repairs) < k:
+            return None
+
+        self.done = True
+        self.decoded += 1
+        if have < k:
+            self._recover()
+        return self.data
+
+
+    def _row(self, k, j, i):
+        key = (k, j, i)
+        row = self._rows.get(key)
+        if row is None:
+            if len(self._rows) >= self.ROW_CACHE_SIZE:
+                self._rows.clear()
+            row = self._rows[key] = gf_mul_row(cauchy(k, j, i))
+        return row
+
+
+    def _recover(self):
+        k = self.k
+        missing = [i for i in range(k) if self.data[i] is None]
+        repair_ids = sorted(self.repairs)[:len(missing)]
+        size = self.size
+
+        # remove the known data packets from the repair symbols
+        rhs = []
+        symbol = bytearray(size)
+        for j in repair_ids:
+            acc = bytearray(self.repairs[j])
+            for i in range(k):
+                packet = self.data[i]
+                if packet is not None:
+                    symbol[0] = len(packet)
+                    symbol[1: len(packet) + 1] = packet
+                    for n in range(len(packet) + 1, size):
+                        symbol[n] = 0
+                    _add_scaled(acc, symbol, self._row(k, j, i))
+            rhs.append(acc)
+
+        # Gauss-Jordan on the Cauchy sub-matrix, always invertible
+        m = len(missing)
+        matrix = [bytearray(cauchy(k, j, i) for i in missing) for j in repair_ids]
+        for col in range(m):
+            pivot = col
+            while matrix[pivot][col] == 0:
+                pivot += 1
+            matrix[col], matrix[pivot] = matrix[pivot], matrix[col]
+            rhs[col], rhs[pivot] = rhs[pivot], rhs[col]
+
+            inv = gf_inv(matrix[col][col])
+            row = gf_mul_row(inv)
+            matrix[col] = bytearray(row[x] for x in matrix[col])
+            rhs[col] = bytearray(row[x] for x in rhs[col])
+
+            for other in range(m):
+                factor = matrix[other][col]
+                if other != col and factor:
+                    row = gf_mul_row(factor)
+                    _add_scaled(matrix[other], matrix[col], row)
+                    _add_scaled(rhs[other], rhs[col], row)
+
+        for n in range(m):
+            symbol = rhs[n]
+            self.data[missing[n]] = bytes(symbol[1: min(symbol[0] + 1, size)])
+        self.recovered += m
@@ -0,0 +1,199 @@
+from sx127x.clock import ticks_ms, ticks_diff
+
+
+# fragment header: message id, fragment index, fragment count, chunk size
+HEADER_LENGTH = 4
+MAX_FRAGMENTS = 255
+
+
+class Fragmenter:
+    """
+    Splits a buffer larger than one packet into numbered fragments.
+    Every fragment but the last carries `chunk` bytes of data.
+    """
+
+    def __init__(self, max_payload = 255):
+        self.chunk = min(max_payload - HEADER_LENGTH, 255)
+        self.msg_id = 0
+        self._header = bytearray(HEADER_LENGTH)
+
+
+    @classmethod
+    def for_radio(cls, lora):
+        return cls(lora.max_payload_length())
+
+
+    def count(self, length):
+        return max(-(-length // self.chunk), 1)
+
+
+    def _next_id(self, length):
+        if self.count(length) > MAX_FRAGMENTS:
+            raise ValueError('Message too long.')
+        self.msg_id = (self.msg_id + 1) & 0xff
+        return self.msg_id
+
+
+    def fragments(self, data):
+        # yields each fragment as bytes, e.g. to put into a TxQueue
+        msg_id = self._next_id(len(data))
+        count = self.count(len(data))
+        data = memoryview(data)
+        for index in range(count):
+            yield bytes((msg_id, index, count, self.chunk)) + data[index * self.chunk: (index + 1) * self.chunk]
+
+
+    def send(self, lora, data):
+        # one packet per fragment, header and data written to the FIFO without copying
+        msg_id = self._next_id(len(data))
+        count = self.count(len(data))
+        header = self._header
+        header[0] = msg_id
+        header[2] = count
+        header[3] = self.chunk
+        data = memoryview(data)
+        for index in range(count):
+            header[1] = index
+            lora.beginPacket()
+            lora.write(header)
+            lora.write(data[index * self.chunk: (index + 1) * self.chunk])
+            lora.endPacket()
+
+
+class _Message:
+
+    __slots__ = ('source', 'msg_id', 'count', 'chunk', 'received', 'fragments', 'length', 'last', 'buffer', 'busy')
+
+    def __init__(self, max_length):
+        self.buffer = bytearray(max_length)
+        self.received = bytearray(MAX_FRAGMENTS // 8 + 1)  # bitmap of received fragments
+        self.busy = False
+
+
+class Reassembler:
+    """
+    Rebuilds fragmented messages in a fixed number of preallocated buffers.
+    Fragments may arrive out of order or twice, incomplete messages are dropped after timeout_ms.
+    The last `recent` completed messages are remembered for timeout_ms, so late
+    duplicates of them are dropped instead of taking a buffer.
+    """
+
+    def __init__(self, max_messages = 2, max_length = 4096, timeout_ms = 30000, recent = 8):
+        self.max_length = max_length
+        self.timeout_ms = timeout_ms
+        self.messages = [_Message(max_length) for i in range(max_messages)]
+
+        # recently completed (source, msg_id), a ring of `recent` entries
+        self._recent_source = [None] * recent
+        self._recent_id = [-1] * recent
+        self._recent_at = [0] * recent
+        self._recent_next = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.dropped = 0      # too long, malformed, or no free buffer
+        self.duplicates = 0
+
+
+    def expire(self):
+        now = ticks_ms()
+        for message in self.messages:
+            if message.busy and ticks_diff(now, message.last) > self.timeout_ms:
+                message.busy = False
+                self.timeouts += 1
+
+
+    def _is_recent(self, source, msg_id):
+        now = ticks_ms()
+        for i in range(len(self._recent_id)):
+            if self._recent_id[i] == msg_id and self._recent_source[i] == source and \
+               ticks_diff(now, self._recent_at[i]) <= self.timeout_ms:
+                return True
+        return False
+
+
+    def _remember(self, source, msg_id):
+        if not self._recent_id:
+            return
+        i = self._recent_next
+        self._recent_source[i] = source
+        self._recent_id[i] = msg_id
+        self._recent_at[i] = ticks_ms()
+        self._recent_next = (i + 1) % len(self._recent_id)
+
+
+    def _find(self, source, msg_id, count, chunk):
+        free = None
+        for message in self.messages:
+            if message.busy:
+                if message.source == source and message.msg_id == msg_id:
+                    return message
+            elif free is None:
+                free = message
+
+        if self._is_recent(source, msg_id):
+            # a late fragment of a message already delivered
+            self.duplicates += 1
+            return None
+
+        if free is None or count * chunk > self.max_length + chunk:
+            self.dropped += 1
+            return None
+
+        free.busy = True
+        free.source = source
+        free.msg_id = msg_id
+        free.count = count
+        free.chunk = chunk
+        free.fragments = 0
+        free.length = 0
+        for i in range(len(free.received)):
+            free.received[i] = 0
+        return free
+
+
+    def feed(self, payload, source = None):
+        """
+        Returns a memoryview of the complete message once its last missing fragment
+        arrives, None otherwise. The view is valid until the next call.
+        """
+
+        self.expire()
+        if len(payload) < HEADER_LENGTH:
+            self.dropped += 1
+            return None
+
+        msg_id, index, count, chunk = payload[0], payload[1], payload[2], payload[3]
+        size = len(payload) - HEADER_LENGTH
+        if index >= count or size > chunk or (index < count - 1 and size != chunk):
+            self.dropped += 1
+            return None
+
+        message = self._find(source, msg_id, count, chunk)
+        if message is None:
+            return None
+        message.last = ticks_ms()
+
+        byte, bit = index >> 3, 1 << (index & 0x07)
+        if message.received[byte] & bit:
+            self.duplicates += 1
+            return None
+
+        offset = index * chunk
+        if offset + size > self.max_length:
+            message.busy = False
+            self.dropped += 1
+            return None
+
+        message.buffer[offset: offset + size] = memoryview(payload)[HEADER_LENGTH:]
+        message.received[byte] |= bit
+        message.fragments += 1
+        if index == count - 1:
+            message.length = offset + size
+
+        if message.fragments < count:
+            return None
+
+        message.busy = False
+        self.completed += 1
+        self._remember(source, message.msg_id)
+        return memoryview(message.buffer)[:message.length]
@@ -0,0 +1,119 @@
+# Compact binary frames.
+#
+# header, 4 bytes:  type (high nibble) | flags (low nibble), source node id (16 bits, big endian), sequence
+# body:             zigzag varint fields (LEB128), so small values of either sign take one byte.
+#
+# pack_into() / unpack_from() work on preallocated buffers and memoryviews, nothing is decoded into strings.
+# frames that are too short or end inside a varint unpack as TYPE_INVALID, they never raise.
+
+HEADER_LENGTH = 4
+MAX_VARINT_LENGTH = 5   # 32-bit values
+
+# frame types
+TYPE_INVALID = -1
+TYPE_DATA = 0x0
+TYPE_ACK = 0x1
+TYPE_PING = 0x2
+TYPE_PONG = 0x3
+TYPE_ADR = 0x4
+
+# flags
+FLAG_ACK_REQUESTED = 0x1
+
+
+def node_id(eui):
+    """
+    16-bit node id folded from a hex EUI string such as Configuration.NODE_EUI.
+    """
+
+    value = 0
+    for i in range(0, len(eui), 4):
+        value ^= int(eui[i: i + 4], 16)
+    return value & 0xffff
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 31)
+
+
+def unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def pack_varint_into(buffer, offset, value):
+    # unsigned, returns the offset after the varint
+    while value > 0x7f:
+        buffer[offset] = (value & 0x7f) | 0x80
+        value >>= 7
+        offset += 1
+    buffer[offset] = value
+    return offset + 1
+
+
+def unpack_varint_from(buffer, offset, length = None):
+    # returns (value, offset after the varint), (None, length) if it runs past length.
+    if length is None:
+        length = len(buffer)
+    value = 0
+    shift = 0
+    while True:
+        if offset >= length or shift >= 7 * MAX_VARINT_LENGTH:
+            return None, length
+        byte = buffer[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+def pack_header_into(buffer, frame_type, source, seq, flags = 0):
+    buffer[0] = ((frame_type & 0x0f) << 4) | (flags & 0x0f)
+    buffer[1] = (source >> 8) & 0xff
+    buffer[2] = source & 0xff
+    buffer[3] = seq & 0xff
+    return HEADER_LENGTH
+
+
+def unpack_header_from(buffer):
+    # returns (type, source, seq, flags)
+    if len(buffer) < HEADER_LENGTH:
+        return TYPE_INVALID, 0, 0, 0
+    return buffer[0] >> 4, (buffer[1] << 8) | buffer[2], buffer[3], buffer[0] & 0x0f
+
+
+def pack_into(buffer, frame_type, source, seq, fields = (), flags = 0):
+    """
+    Writes a frame with signed integer fields into buffer, returns its length.
+    """
+
+    offset = pack_header_into(buffer, frame_type, source, seq, flags)
+    for value in fields:
+        offset = pack_varint_into(buffer, offset, zigzag(value))
+    return offset
+
+
+def unpack_from(buffer, fields, length = None):
+    """
+    Reads a frame, its fields are stored into the preallocated list `fields`.
+    Returns (type, source, seq, flags, number of fields read),
+    type is TYPE_INVALID for a malformed frame.
+    """
+
+    if length is None:
+        length = len(buffer)
+    length = min(length, len(buffer))
+    if length < HEADER_LENGTH:
+        return TYPE_INVALID, 0, 0, 0, 0
+
+    offset = HEADER_LENGTH
+    count = 0
+    while offset < length and count < len(fields):
+        value, offset = unpack_varint_from(buffer, offset, length)
+        if value is None:
+            return TYPE_INVALID, 0, 0, 0, 0
+        fields[count] = unzigzag(value)
+        count += 1
+
+    frame_type, source, seq, flags = unpack_header_from(buffer)
+    return frame_type, source, seq, flags, count
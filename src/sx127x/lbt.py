@@ -0,0 +1,39 @@
+try:
+    from random import getrandbits
+except ImportError:
+    from urandom import getrandbits
+
+from sx127x.clock import sleep_ms
+
+
+class ListenBeforeTalk:
+    """
+    CSMA for endPacket(): the channel is checked with CAD before transmitting and,
+    while it is busy, checked again after a random exponential backoff.
+    """
+
+    def __init__(self, min_backoff_ms = 50, max_backoff_ms = 2000, max_attempts = 8, factor = 2):
+        self.min_backoff_ms = min_backoff_ms
+        self.max_backoff_ms = max_backoff_ms
+        self.max_attempts = max_attempts
+        self.factor = factor
+        self.busy = 0       # CAD found the channel busy
+        self.failures = 0   # gave up after max_attempts
+
+
+    def backoff_ms(self, attempt):
+        # uniform in [min_backoff_ms, window), the window grows by factor per attempt
+        window = min(self.min_backoff_ms * self.factor ** attempt, self.max_backoff_ms)
+        span = max(window - self.min_backoff_ms, 1)
+        return self.min_backoff_ms + getrandbits(16) % span
+
+
+    def acquire(self, lora):
+        for attempt in range(self.max_attempts):
+            if not lora.cad():
+                return True
+            self.busy += 1
+            sleep_ms(self.backoff_ms(attempt))
+
+        self.failures += 1
+        return False
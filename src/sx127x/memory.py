@@ -0,0 +1,53 @@
+import gc
+
+
+class MemoryPolicy:
+    """
+    Decides when the garbage collector runs after a packet is sent or received.
+    """
+
+    NEVER = 0               # leave it to the allocator
+    EVERY_N_PACKETS = 1     # collect after every `every` packets
+    LOW_MEMORY = 2          # collect when free heap falls below `threshold` bytes
+    IDLE = 3                # mark as pending, collect on the next idle() call
+
+    def __init__(self, mode = NEVER, every = 1, threshold = 0, on_telemetry = None):
+        """
+        :param on_telemetry: called as on_telemetry(mem_free, mem_alloc) after each collection.
+        """
+
+        self.mode = mode
+        self.every = every
+        self.threshold = threshold
+        self.on_telemetry = on_telemetry
+        self.packets = 0
+        self.pending = False
+
+
+    def packet_done(self):
+        mode = self.mode
+
+        if mode == self.EVERY_N_PACKETS:
+            self.packets += 1
+            if self.packets >= self.every:
+                self.packets = 0
+                self.collect()
+
+        elif mode == self.LOW_MEMORY:
+            if hasattr(gc, 'mem_free') and gc.mem_free() < self.threshold:
+                self.collect()
+
+        elif mode == self.IDLE:
+            self.pending = True
+
+
+    def idle(self):
+        if self.pending:
+            self.pending = False
+            self.collect()
+
+
+    def collect(self):
+        gc.collect()
+        if self.on_telemetry and hasattr(gc, 'mem_free'):
+            self.on_telemetry(gc.mem_free(), gc.mem_alloc())
@@ -0,0 +1,44 @@
+class Packet:
+    """
+    A received packet and the link metadata captured with it in the IRQ handler.
+    Raw register values are stored so that filling it does not allocate,
+    snr and freq_error are derived on access.
+    """
+
+    __slots__ = ('payload', 'length', 'rssi', 'snr_raw', 'crc_ok', 'fei_raw', 'timestamp', 'bandwidth')
+
+    FXOSC = 32E6
+
+    def __init__(self, payload = None):
+        self.payload = payload      # memoryview of the payload, valid until the slot is released
+        self.length = 0
+        self.rssi = 0               # dBm
+        self.snr_raw = 0            # signed, quarter dB
+        self.crc_ok = True
+        self.fei_raw = 0            # signed 20 bits, RegFei
+        self.timestamp = 0          # ticks_us() when DIO0 fired
+        self.bandwidth = 125E3
+
+
+    @property
+    def snr(self):
+        return self.snr_raw * 0.25
+
+
+    @property
+    def freq_error(self):
+        # Hz, datasheet 4.1.5: Ferr = FreqError * 2^24 / Fxtal * BW[kHz] / 500
+        return self.fei_raw * (1 << 24) / self.FXOSC * self.bandwidth / 500E3
+
+
+    def copy(self):
+        # a Packet that outlives the ring slot, the payload is copied into bytes.
+        packet = Packet(bytes(self.payload))
+        packet.length = self.length
+        packet.rssi = self.rssi
+        packet.snr_raw = self.snr_raw
+        packet.crc_ok = self.crc_ok
+        packet.fei_raw = self.fei_raw
+        packet.timestamp = self.timestamp
+        packet.bandwidth = self.bandwidth
+        return packet
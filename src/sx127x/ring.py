@@ -0,0 +1,61 @@
+from sx127x.packet import Packet
+
+
+class PacketRing:
+    """
+    Fixed-size ring of received packets, preallocated so it can be filled from an IRQ handler.
+    One producer (the IRQ) and one consumer (the dispatcher).
+    """
+
+    def __init__(self, slots = 4, slot_size = 255):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.storage = bytearray(slots * slot_size)
+        self.buffers = [memoryview(self.storage)[i * slot_size: (i + 1) * slot_size] for i in range(slots)]
+        self.lengths = bytearray(slots)  # slot_size <= 255
+        self.packets = [Packet() for i in range(slots)]
+        self.head = 0       # next slot to fill, counts modulo 2 * slots
+        self.tail = 0       # oldest filled slot, counts modulo 2 * slots
+        self.overruns = 0   # packets dropped because the ring was full
+
+
+    def __len__(self):
+        return (self.head - self.tail) % (2 * self.slots)
+
+
+    def reserve(self):
+        # index of the slot to fill, -1 when full.
+        if len(self) == self.slots:
+            self.overruns += 1
+            return -1
+        return self.head % self.slots
+
+
+    def commit(self, slot, length):
+        self.lengths[slot] = length
+        self.head = (self.head + 1) % (2 * self.slots)
+
+
+    def peek(self):
+        # index of the oldest filled slot, -1 when empty.
+        if self.head == self.tail:
+            return -1
+        return self.tail % self.slots
+
+
+    def payload(self, slot):
+        return self.buffers[slot][:self.lengths[slot]]
+
+
+    def packet(self, slot):
+        packet = self.packets[slot]
+        packet.payload = self.payload(slot)
+        return packet
+
+
+    def release(self):
+        self.tail = (self.tail + 1) % (2 * self.slots)
+
+
+    def clear(self):
+        self.tail = self.head
@@ -0,0 +1,28 @@
+# Run a function soon, outside of interrupt context.
+# MicroPython queues it with micropython.schedule, CPython hands it to a worker thread.
+
+try:
+    from micropython import schedule
+
+except ImportError:
+    import queue
+    import threading
+    import traceback
+
+    _pending = queue.SimpleQueue()
+    _worker = None
+
+    def _run():
+        while True:
+            func, arg = _pending.get()
+            try:
+                func(arg)
+            except Exception:
+                traceback.print_exc()
+
+    def schedule(func, arg):
+        global _worker
+        if _worker is None:
+            _worker = threading.Thread(target = _run, daemon = True)
+            _worker.start()
+        _pending.put((func, arg))
@@ -1,18 +1,20 @@
 from time import sleep 
-import gc
-from sx127x.config import CONFIG
-from machine import Pin
+from sx127x.airtime import AirtimeTable
+from sx127x.bus import SpiBus
+from sx127x.clock import ticks_ms, ticks_us, ticks_diff, ticks_add, sleep_ms, lightsleep_ms
+from sx127x.channels import frf
+from sx127x.memory import MemoryPolicy
+from sx127x.schedule import schedule
 
+try:
+    from machine import Pin
+    IRQ_RISING = Pin.IRQ_RISING
 
-class SX127x:
+except ImportError:
+    IRQ_RISING = 1  # Linux hosts, the controller's pins only fire on rising edges
 
-    freqs = {'169E6': (42, 64, 0),
-             '433e6': (108, 64, 0),
-             '434E6': (108, 128, 0),
-             '866E6': (216, 128, 0),
-             '868E6': (217, 0, 0),
-             '915E6': (228, 192, 0)}
 
+class SX127x:
 
     PA_OUTPUT_RFO_PIN = 0
     PA_OUTPUT_PA_BOOST_PIN = 1
@@ -37,15 +39,20 @@ class SX127x:
     REG_IRQ_FLAGS_MASK = 0x11
     REG_IRQ_FLAGS = 0x12
     REG_RX_NB_BYTES = 0x13
+    REG_MODEM_STAT = 0x18
+    REG_PKT_SNR_VALUE = 0x19
     REG_PKT_RSSI_VALUE = 0x1a
-    REG_PKT_SNR_VALUE = 0x1b
+    REG_HOP_CHANNEL = 0x1c
     REG_MODEM_CONFIG_1 = 0x1d
     REG_MODEM_CONFIG_2 = 0x1e
+    REG_SYMB_TIMEOUT_LSB = 0x1f
     REG_PREAMBLE_MSB = 0x20
     REG_PREAMBLE_LSB = 0x21
     REG_PAYLOAD_LENGTH = 0x22
+    REG_HOP_PERIOD = 0x24
     REG_FIFO_RX_BYTE_ADDR = 0x25
     REG_MODEM_CONFIG_3 = 0x26
+    REG_FEI_MSB = 0x28
     REG_RSSI_WIDEBAND = 0x2c
     REG_DETECTION_OPTIMIZE = 0x31
     REG_DETECTION_THRESHOLD = 0x37
@@ -60,11 +67,23 @@ class SX127x:
     MODE_TX = 0x03
     MODE_RX_CONTINUOUS = 0x05
     MODE_RX_SINGLE = 0x06
+    MODE_CAD = 0x07
 
     # PA config
     PA_BOOST = 0x80
 
+    # DIO0 mappings
+    DIO0_RX_DONE = 0x00
+    DIO0_TX_DONE = 0x01
+    DIO0_CAD_DONE = 0x02
+
+    # DIO2 mappings
+    DIO2_FHSS_CHANGE_CHANNEL = 0x00
+
     # IRQ masks
+    IRQ_CAD_DETECTED_MASK = 0x01
+    IRQ_FHSS_CHANGE_CHANNEL_MASK = 0x02
+    IRQ_CAD_DONE_MASK = 0x04
     IRQ_TX_DONE_MASK = 0x08
     IRQ_PAYLOAD_CRC_ERROR_MASK = 0x20
     IRQ_RX_DONE_MASK = 0x40
@@ -73,6 +92,40 @@ class SX127x:
     # Buffer size
     MAX_PKT_LENGTH = 255
 
+    # packet status, read in one burst from REG_FIFO_RX_CURRENT_ADDR to REG_PKT_RSSI_VALUE
+    STATUS_LENGTH = REG_PKT_RSSI_VALUE - REG_FIFO_RX_CURRENT_ADDR + 1
+    STATUS_IRQ_FLAGS = REG_IRQ_FLAGS - REG_FIFO_RX_CURRENT_ADDR
+    STATUS_RX_NB_BYTES = REG_RX_NB_BYTES - REG_FIFO_RX_CURRENT_ADDR
+    STATUS_PKT_SNR_VALUE = REG_PKT_SNR_VALUE - REG_FIFO_RX_CURRENT_ADDR
+    STATUS_PKT_RSSI_VALUE = REG_PKT_RSSI_VALUE - REG_FIFO_RX_CURRENT_ADDR
+
+    # TX timeout = time on air * factor + margin
+    TX_TIMEOUT_FACTOR = 1.5
+    TX_TIMEOUT_MARGIN_MS = 100
+
+    # CAD lasts about two symbols
+    CAD_TIMEOUT_SYMBOLS = 4
+    CAD_TIMEOUT_MARGIN_MS = 10
+
+    # sniffing: a CAD must land in the preamble with this many symbols
+    # left for the CAD itself and for the receiver to lock on.
+    SNIFF_MARGIN_SYMBOLS = 8
+
+    # parameters the airtime table depends on, and how many profiles' tables are kept
+    AIRTIME_PARAMETERS = ('spreading_factor', 'signal_bandwidth', 'coding_rate',
+                          'preamble_length', 'implicitHeader', 'enable_CRC')
+    AIRTIME_CACHE_SIZE = 4
+
+    # configuration registers owned by the driver, in ascending address order.
+    # they are kept in a write-through shadow copy and written by configure().
+    CONFIG_REGISTERS = (REG_FRF_MSB, REG_FRF_MID, REG_FRF_LSB, REG_PA_CONFIG,
+                        REG_LNA, REG_FIFO_TX_BASE_ADDR, REG_FIFO_RX_BASE_ADDR,
+                        REG_MODEM_CONFIG_1, REG_MODEM_CONFIG_2, REG_SYMB_TIMEOUT_LSB,
+                        REG_PREAMBLE_MSB, REG_PREAMBLE_LSB, REG_MODEM_CONFIG_3,
+                        REG_DETECTION_OPTIMIZE, REG_DETECTION_THRESHOLD, REG_SYNC_WORD)
+
+    BANDWIDTHS = (7.8E3, 10.4E3, 15.6E3, 20.8E3, 31.25E3, 41.7E3, 62.5E3, 125E3, 250E3)
+
     # The controller can be ESP8266, ESP32, Raspberry Pi, or a PC.
     # The controller needs to provide an interface consisted of:
     # 1. a SPI, with transfer function.
@@ -82,107 +135,376 @@ class SX127x:
     #   3.2 detach_irq()
     # 4. a function to blink on-board LED.
 
-    def __init__(self, frequency, spi, name = 'SX127x', on_receive = None, **kwargs):
+    def __init__(self, frequency, spi, name = 'SX127x', on_receive = None, memory_policy = None, **kwargs):
 
         """
-        :param frequency:  e.g. "915E6"
+        :param frequency:  in Hz, e.g. 915000000. strings such as "915E6" are accepted too.
         """
 
         parameters = {'frequency': frequency, 'tx_power_level': 2, 'signal_bandwidth': 125E3,
                       'spreading_factor': 8, 'coding_rate': 5, 'preamble_length': 8,
-                      'implicitHeader': False, 'sync_word': 0x12, 'enable_CRC': False}
+                      'implicitHeader': False, 'sync_word': 0x12, 'enable_CRC': False,
+                      'symbol_timeout': 0x64}
 
         self.frequency = frequency
         parameters.update(**kwargs)
         self.name = name
         self.parameters = parameters 
         self._on_receive = on_receive
-        self.spi = spi
+        self.memory_policy = memory_policy or MemoryPolicy()
+        self._payload_buffer = bytearray(self.MAX_PKT_LENGTH)
+
+        # preallocated SPI buffers, register access must not allocate.
+        self._tx_buffer = bytearray(2)
+        self._rx_buffer = bytearray(2)
+        self._address_buffer = memoryview(self._tx_buffer)[:1]
+
+        # None marks a register whose shadow value is not known yet.
+        self._shadow = dict.fromkeys(self.CONFIG_REGISTERS)
+        self._config_image = bytearray(self.CONFIG_REGISTERS[-1] + 1)
+        self._paOutputPin = self.PA_OUTPUT_PA_BOOST_PIN
+        self._implicitHeaderMode = None
+        self._dioMapping1 = 0x00
+        self._frequency = None
+        self._frf = None
+        self._rssi_offset = 157
+
+        self._on_tx_done = None
+        self._payload_length = 0
+        self._tx_pending = False
+        self._tx_deadline = 0
+
+        # optional receive ring, filled in the IRQ and drained by a scheduled dispatcher.
+        self.rx_ring = None
+        self.accept_crc_errors = False
+        self._on_packet = None
+        self._status_buffer = bytearray(self.STATUS_LENGTH)
+        self._fei_buffer = bytearray(3)
+        self._dispatch_scheduled = False
+        self._dispatch_received = self.dispatch_received  # bound once, the IRQ must not allocate
+
+        # frequency hopping, FRF bytes per hop of the sequence.
+        self._hop_frfs = None
+
+        # optional ListenBeforeTalk and DutyCycle consulted by endPacket()
+        self.lbt = None
+        self.duty_cycle = None
+        self._airtime = None
+        self._airtime_tables = {}
+
+        # set while receiveSingle() polls the IRQ flags itself
+        self._rx_polling = False
+
+        # the SPI is shared with any other transceiver on the same bus, an
+        # optional IrqScheduler runs the DIO handlers outside of interrupt context.
+        self.spi = SpiBus.of(spi)
+        self.irq_scheduler = None
 
      
     def init(self, **parameters):
-        if parameters:
-            self.parameters = parameters
+        self.parameters.update(parameters)
+        self._airtime = None
+        self.spi.join(self)
             
         # check version
         version = self.readRegister(self.REG_VERSION)
         if version != 0x12:
             raise Exception('Invalid version.')
-            
+
+        # registers are back to their reset values
+        self.invalidate()
+        self._dioMapping1 = 0x00
+        self._tx_pending = False
+        self._hop_frfs = None
         
         # put in LoRa and sleep mode
         self.sleep()
-        
-        
-        # config
-        self.setFrequency(self.parameters['frequency']) 
-        self.setSignalBandwidth(self.parameters['signal_bandwidth'])
-
-        # set LNA boost
-        self.writeRegister(self.REG_LNA, self.readRegister(self.REG_LNA) | 0x03)
 
-        # set auto AGC
-        self.writeRegister(self.REG_MODEM_CONFIG_3, 0x04)
-
-        self.setTxPower(self.parameters['tx_power_level'])
-        self._implicitHeaderMode = None
-        self.implicitHeaderMode(self.parameters['implicitHeader'])
-        self.setSpreadingFactor(self.parameters['spreading_factor'])
-        self.setCodingRate(self.parameters['coding_rate'])
-        self.setPreambleLength(self.parameters['preamble_length'])
-        self.setSyncWord(self.parameters['sync_word'])
-        self.enableCRC(self.parameters['enable_CRC'])
-        
-        # set LowDataRateOptimize flag if symbol time > 16ms (default disable on reset)
-        # self.writeRegister(REG_MODEM_CONFIG_3, self.readRegister(REG_MODEM_CONFIG_3) & 0xF7)  # default disable on reset
-        if 1000 / (self.parameters['signal_bandwidth'] / 2**self.parameters['spreading_factor']) > 16:
-            self.writeRegister(self.REG_MODEM_CONFIG_3, self.readRegister(self.REG_MODEM_CONFIG_3) | 0x08)
-        
-        # set base addresses
-        self.writeRegister(self.REG_FIFO_TX_BASE_ADDR, self.FIFO_TX_BASE_ADDR)
-        self.writeRegister(self.REG_FIFO_RX_BASE_ADDR, self.FIFO_RX_BASE_ADDR)
+        # config, every register is written since the shadow copy is empty.
+        self.configure()
         
         self.standby() 
               
         
+    def configure(self, **parameters):
+        self.parameters.update(parameters)
+        for key in self.AIRTIME_PARAMETERS:
+            if key in parameters:
+                self._airtime = None
+                break
+        frequency = self.parameters['frequency']
+        if not isinstance(frequency, int):  # e.g. 915E6 or '915E6'
+            frequency = int(float(frequency))
+        if frequency != self._frequency:
+            self._tune(frequency, frf(frequency))
+        self._implicitHeaderMode = self.parameters['implicitHeader']
+
+        image = self._config_image
+        self.build_config_image(image)
+
+        # write only the registers that differ from the shadow copy, as one
+        # burst per run of contiguous addresses.
+        shadow = self._shadow
+        start = end = previous = None
+        for address in self.CONFIG_REGISTERS:
+            if previous is not None and address != previous + 1:
+                self._write_config_run(image, start, end)
+                start = end = None
+            if shadow[address] != image[address]:
+                if start is None:
+                    start = address
+                end = address
+            previous = address
+        self._write_config_run(image, start, end)
+
+
+    def _write_config_run(self, image, start, end):
+        if start is None:
+            return
+        if start == end:
+            self.writeRegister(start, image[start])
+        else:
+            self.writeBurst(start, memoryview(image)[start:end + 1])
+
+
+    def build_config_image(self, image):
+        parameters = self.parameters
+
+        image[self.REG_FRF_MSB] = self._frf[0]
+        image[self.REG_FRF_MID] = self._frf[1]
+        image[self.REG_FRF_LSB] = self._frf[2]
+
+        if self._paOutputPin == self.PA_OUTPUT_RFO_PIN:
+            level = min(max(parameters['tx_power_level'], 0), 14)
+            image[self.REG_PA_CONFIG] = 0x70 | level
+        else:
+            level = min(max(parameters['tx_power_level'], 2), 17)
+            image[self.REG_PA_CONFIG] = self.PA_BOOST | (level - 2)
+
+        # LNA boost
+        image[self.REG_LNA] = 0x20 | 0x03
+
+        # base addresses
+        image[self.REG_FIFO_TX_BASE_ADDR] = self.FIFO_TX_BASE_ADDR
+        image[self.REG_FIFO_RX_BASE_ADDR] = self.FIFO_RX_BASE_ADDR
+
+        bw = self.bandwidth_index(parameters['signal_bandwidth'])
+        cr = min(max(parameters['coding_rate'], 5), 8) - 4
+        image[self.REG_MODEM_CONFIG_1] = (bw << 4) | (cr << 1) | (0x01 if parameters['implicitHeader'] else 0x00)
+
+        sf = min(max(parameters['spreading_factor'], 6), 12)
+        symbol_timeout = parameters['symbol_timeout']
+        image[self.REG_MODEM_CONFIG_2] = (sf << 4) | (0x04 if parameters['enable_CRC'] else 0x00) | \
+                                         ((symbol_timeout >> 8) & 0x03)
+        image[self.REG_SYMB_TIMEOUT_LSB] = symbol_timeout & 0xff
+
+        preamble_length = parameters['preamble_length']
+        image[self.REG_PREAMBLE_MSB] = (preamble_length >> 8) & 0xff
+        image[self.REG_PREAMBLE_LSB] = (preamble_length >> 0) & 0xff
+
+        # auto AGC, and LowDataRateOptimize if symbol time > 16ms
+        image[self.REG_MODEM_CONFIG_3] = 0x04 | (0x08 if self.symbol_time_ms() > 16 else 0x00)
+
+        image[self.REG_DETECTION_OPTIMIZE] = 0xc5 if sf == 6 else 0xc3
+        image[self.REG_DETECTION_THRESHOLD] = 0x0c if sf == 6 else 0x0a
+        image[self.REG_SYNC_WORD] = parameters['sync_word']
+
+
+    def bandwidth_index(self, sbw):
+        for i in range(len(self.BANDWIDTHS)):
+            if sbw <= self.BANDWIDTHS[i]:
+                return i
+        return 9
+
+
+    def symbol_time_ms(self):
+        return 1000 * 2**self.parameters['spreading_factor'] / self.parameters['signal_bandwidth']
+
+
+    def airtime_table(self):
+        # looked up after each profile change, built only for a profile not seen lately
+        if self._airtime is None:
+            parameters = self.parameters
+            profile = tuple(parameters[key] for key in self.AIRTIME_PARAMETERS)
+            tables = self._airtime_tables
+            table = tables.get(profile)
+            if table is None:
+                if len(tables) >= self.AIRTIME_CACHE_SIZE:
+                    tables.clear()
+                table = tables[profile] = AirtimeTable.from_parameters(parameters)
+            self._airtime = table
+        return self._airtime
+
+
+    def time_on_air_ms(self, payload_length):
+        return self.airtime_table().time_on_air_ms(payload_length)
+
+
+    def tx_timeout_ms(self, payload_length):
+        return int(self.time_on_air_ms(payload_length) * self.TX_TIMEOUT_FACTOR) + self.TX_TIMEOUT_MARGIN_MS
+
+
     def beginPacket(self, implicitHeaderMode = False):        
+        # wait for a non-blocking transmission still in flight
+        while not self.poll_tx():
+            pass
+
         self.standby()
         self.implicitHeaderMode(implicitHeaderMode)
  
         # reset FIFO address and paload length 
         self.writeRegister(self.REG_FIFO_ADDR_PTR, self.FIFO_TX_BASE_ADDR)
         self.writeRegister(self.REG_PAYLOAD_LENGTH, 0)
+        self._payload_length = 0
      
 
-    def endPacket(self):
+    def endPacket(self, wait = True):
+        airtime = self.time_on_air_ms(self._payload_length)
+        timeout = self.tx_timeout_ms(self._payload_length)
+
+        duty_cycle = self.duty_cycle
+        if duty_cycle:
+            delay = duty_cycle.delay_ms(self._frequency)
+            if delay:
+                # without wait the caller waits for duty_cycle.delay_ms() itself, never here
+                if not wait or (duty_cycle.max_delay_ms is not None and delay > duty_cycle.max_delay_ms):
+                    duty_cycle.rejected += 1
+                    raise Exception('Duty cycle exceeded.')
+                sleep_ms(delay)
+
+        if self.lbt and not self.lbt.acquire(self):
+            raise Exception('Channel busy.')
+
+        if duty_cycle:
+            duty_cycle.record(self._frequency, airtime)
+
+        if not wait:
+            # return immediately, TX_DONE is reported on DIO0 (or by poll_tx).
+            # poll_tx() must still be called now and then: a radio that never
+            # raises TX_DONE is only timed out there.
+            if self.pin_RxDone:
+                self.setDioMapping(0, self.DIO0_TX_DONE)
+                self.attach_irq_handler(self.pin_RxDone, self.handleOnDio0)
+            self._tx_pending = True
+            self._tx_deadline = ticks_add(ticks_ms(), timeout)
+            self._startHopping()
+            self.writeRegister(self.REG_OP_MODE, self.MODE_LONG_RANGE_MODE | self.MODE_TX)
+            return
+
         # put in TX mode
+        self._startHopping()
         self.writeRegister(self.REG_OP_MODE, self.MODE_LONG_RANGE_MODE | self.MODE_TX)
+        start = ticks_ms()
 
         # wait for TX done, standby automatically on TX_DONE
-        while (self.readRegister(self.REG_IRQ_FLAGS) & self.IRQ_TX_DONE_MASK) == 0:
-            pass 
+        while True:
+            irqFlags = self.readRegister(self.REG_IRQ_FLAGS)
+            if irqFlags & self.IRQ_TX_DONE_MASK:
+                break
+            if irqFlags & self.IRQ_FHSS_CHANGE_CHANNEL_MASK:
+                self.handleOnFhssChangeChannel(None)
+            if ticks_diff(ticks_ms(), start) > timeout:
+                self.standby()
+                raise Exception('TX timeout.')
             
         # clear IRQ's
         self.writeRegister(self.REG_IRQ_FLAGS, self.IRQ_TX_DONE_MASK)
         
-        self.collect_garbage()
+        self.memory_policy.packet_done()
+
+
+    def isReceiving(self):
+        # a packet is being demodulated: signal detected or synchronized
+        return (self.readRegister(self.REG_MODEM_STAT) & 0x03) != 0
+
+
+    def setListenBeforeTalk(self, lbt):
+        self.lbt = lbt
+
+
+    def setDutyCycle(self, duty_cycle):
+        self.duty_cycle = duty_cycle
+
+
+    def cad(self, timeout_ms = None):
+        # Channel Activity Detection, True if a LoRa preamble was seen.
+        # the radio is back in standby afterwards.
+        if timeout_ms is None:
+            timeout_ms = int(self.symbol_time_ms() * self.CAD_TIMEOUT_SYMBOLS) + self.CAD_TIMEOUT_MARGIN_MS
+
+        self.writeRegister(self.REG_IRQ_FLAGS, self.IRQ_CAD_DONE_MASK | self.IRQ_CAD_DETECTED_MASK)
+        self.writeRegister(self.REG_OP_MODE, self.MODE_LONG_RANGE_MODE | self.MODE_CAD)
+        start = ticks_ms()
+
+        # with a DIO3 (CadDone) pin, wait on the pin instead of polling over SPI
+        pin = self.pin_CadDone
+        while True:
+            if pin is None or pin.value():
+                irqFlags = self.readRegister(self.REG_IRQ_FLAGS)
+                if irqFlags & self.IRQ_CAD_DONE_MASK:
+                    break
+            if ticks_diff(ticks_ms(), start) > timeout_ms:
+                self.standby()
+                raise Exception('CAD timeout.')
+
+        self.writeRegister(self.REG_IRQ_FLAGS, irqFlags & (self.IRQ_CAD_DONE_MASK | self.IRQ_CAD_DETECTED_MASK))
+        return (irqFlags & self.IRQ_CAD_DETECTED_MASK) != 0
+
+
+    def poll_tx(self):
+        # True once no transmission is in flight. Without a DIO0 pin, or with its
+        # handler deferred to an IrqScheduler, the IRQ flags are read here,
+        # otherwise only the timeout is checked.
+        # nothing else enforces the deadline, call it periodically (the main loop,
+        # beginPacket(), TxQueue.service() and AsyncSX127x do) while a TX is pending.
+        if self._tx_pending:
+            if not self.pin_RxDone or self.irq_scheduler:
+                if self.readRegister(self.REG_IRQ_FLAGS) & self.IRQ_TX_DONE_MASK:
+                    self.writeRegister(self.REG_IRQ_FLAGS, self.IRQ_TX_DONE_MASK)
+                    self._finish_tx(True)
+                    return True
+
+            if ticks_diff(ticks_ms(), self._tx_deadline) > 0:
+                self.standby()
+                self._finish_tx(False)
+
+        return not self._tx_pending
+
+
+    def _finish_tx(self, success):
+        self._tx_pending = False
+
+        if self.pin_RxDone:
+            self.setDioMapping(0, self.DIO0_RX_DONE)
+            if not (self._on_receive or self._on_packet):
+                self.detach_irq_handler(self.pin_RxDone)
+
+        self.memory_policy.packet_done()
+        if self._on_tx_done:
+            self._on_tx_done(self, success)
    
 
     def write(self, buffer):
-        currentLength = self.readRegister(self.REG_PAYLOAD_LENGTH)
+        currentLength = self._payload_length
         size = len(buffer)
 
         # check size
         size = min(size, (self.MAX_PKT_LENGTH - self.FIFO_TX_BASE_ADDR - currentLength))
 
-        # write data
-        for i in range(size):
-            self.writeRegister(self.REG_FIFO, buffer[i])
+        # write data, streamed into the FIFO in a single burst
+        if size < len(buffer):
+            buffer = memoryview(buffer)[:size]
+        self.writeBurst(self.REG_FIFO, buffer)
         
         # update length        
-        self.writeRegister(self.REG_PAYLOAD_LENGTH, currentLength + size)
+        self._payload_length = currentLength + size
+        self.writeRegister(self.REG_PAYLOAD_LENGTH, self._payload_length)
         return size
 
+    def max_payload_length(self):
+        return self.MAX_PKT_LENGTH - self.FIFO_TX_BASE_ADDR
+
+
     def println(self, string, implicitHeader = False):
         self.beginPacket(implicitHeader)
         self.write(string.encode())
@@ -195,11 +517,12 @@ class SX127x:
 
         
     def packetRssi(self):
-        return (self.readRegister(self.REG_PKT_RSSI_VALUE) - (164 if float(self._frequency) < 868E6 else 157))
+        return (self.readRegister(self.REG_PKT_RSSI_VALUE) - self._rssi_offset)
 
 
     def packetSnr(self):
-        return (self.readRegister(self.REG_PKT_SNR_VALUE)) * 0.25
+        snr = self.readRegister(self.REG_PKT_SNR_VALUE)
+        return (snr - 256 if snr > 127 else snr) * 0.25
         
        
     def standby(self):
@@ -211,77 +534,108 @@ class SX127x:
         
         
     def setTxPower(self, level, outputPin = PA_OUTPUT_PA_BOOST_PIN):
-        if (outputPin == self.PA_OUTPUT_RFO_PIN):
-            # RFO
-            level = min(max(level, 0), 14)
-            self.writeRegister(self.REG_PA_CONFIG, 0x70 | level)
-            
-        else:
-            # PA BOOST                
-            level = min(max(level, 2), 17)
-            self.writeRegister(self.REG_PA_CONFIG, self.PA_BOOST | (level - 2))
+        self._paOutputPin = outputPin
+        self.configure(tx_power_level = level)
             
 
     def setFrequency(self, frequency):
-        self._frequency = frequency    
-        
-        self.writeRegister(self.REG_FRF_MSB, self.freqs[frequency][0])
-        self.writeRegister(self.REG_FRF_MID, self.freqs[frequency][1])
-        self.writeRegister(self.REG_FRF_LSB, self.freqs[frequency][2])
+        self.configure(frequency = frequency)
         
 
+    def tuned_frequency(self):
+        # the frequency the radio is tuned to in Hz, after setChannel() and hops too.
+        return self._frequency
+
+
+    def setChannel(self, plan, index):
+        # retune to a ChannelPlan channel, a single burst of its precomputed FRF bytes.
+        self._tune(plan.frequencies[index], plan.frfs[index])
+        self.writeBurst(self.REG_FRF_MSB, self._frf)
+
+
+    def _tune(self, frequency, frf):
+        self.parameters['frequency'] = frequency
+        self._frequency = frequency
+        self._frf = frf
+        self._rssi_offset = 164 if frequency < 868000000 else 157
+
+
+    def setHopping(self, plan, sequence = None, hop_period = 20):
+        # on-chip FHSS: the radio changes channel every hop_period symbols and
+        # raises FhssChangeChannel on DIO2, the handler writes the FRF of the next hop.
+        # without a DIO2 pin hops are only serviced by the blocking endPacket().
+        if sequence is None:
+            sequence = range(len(plan))
+        self._hop_frfs = tuple(plan.frfs[i] for i in sequence)
+        self.writeRegister(self.REG_HOP_PERIOD, hop_period)
+
+        if self.pin_ValidHeader:
+            self.setDioMapping(2, self.DIO2_FHSS_CHANGE_CHANNEL)
+            self.attach_irq_handler(self.pin_ValidHeader, self.handleOnFhssChangeChannel)
+
+
+    def disableHopping(self):
+        self._hop_frfs = None
+        self.writeRegister(self.REG_HOP_PERIOD, 0)
+        if self.pin_ValidHeader:
+            self.detach_irq_handler(self.pin_ValidHeader)
+        self.writeBurst(self.REG_FRF_MSB, self._frf)
+
+
+    def _startHopping(self):
+        # every packet starts on the first hop
+        if self._hop_frfs:
+            self.writeBurst(self.REG_FRF_MSB, self._hop_frfs[0])
+
+
+    def handleOnFhssChangeChannel(self, event_source):
+        hop_frfs = self._hop_frfs
+        if hop_frfs:
+            channel = self.readRegister(self.REG_HOP_CHANNEL) & 0x3f
+            self.writeBurst(self.REG_FRF_MSB, hop_frfs[channel % len(hop_frfs)])
+        self.writeRegister(self.REG_IRQ_FLAGS, self.IRQ_FHSS_CHANGE_CHANNEL_MASK)
+
+
     def setSpreadingFactor(self, sf):
-        sf = min(max(sf, 6), 12)
-        self.writeRegister(self.REG_DETECTION_OPTIMIZE, 0xc5 if sf == 6 else 0xc3)
-        self.writeRegister(self.REG_DETECTION_THRESHOLD, 0x0c if sf == 6 else 0x0a)
-        self.writeRegister(self.REG_MODEM_CONFIG_2, (self.readRegister(self.REG_MODEM_CONFIG_2) & 0x0f) | ((sf << 4) & 0xf0))
+        self.configure(spreading_factor = sf)
 
         
     def setSignalBandwidth(self, sbw):        
-        bins = (7.8E3, 10.4E3, 15.6E3, 20.8E3, 31.25E3, 41.7E3, 62.5E3, 125E3, 250E3)
-
-        bw = 9        
-        for i in range(len(bins)):
-            if sbw <= bins[i]:
-                bw = i
-                break
-                
-        # bw = bins.index(sbw)
-        
-        self.writeRegister(self.REG_MODEM_CONFIG_1, (self.readRegister(self.REG_MODEM_CONFIG_1) & 0x0f) | (bw << 4))
+        self.configure(signal_bandwidth = sbw)
 
 
     def setCodingRate(self, denominator):
-        denominator = min(max(denominator, 5), 8)        
-        cr = denominator - 4
-        self.writeRegister(self.REG_MODEM_CONFIG_1, (self.readRegister(self.REG_MODEM_CONFIG_1) & 0xf1) | (cr << 1))
+        self.configure(coding_rate = denominator)
         
 
     def setPreambleLength(self, length):
-        self.writeRegister(self.REG_PREAMBLE_MSB,  (length >> 8) & 0xff)
-        self.writeRegister(self.REG_PREAMBLE_LSB,  (length >> 0) & 0xff)
+        self.configure(preamble_length = length)
         
         
     def enableCRC(self, enable_CRC = False):
-        modem_config_2 = self.readRegister(self.REG_MODEM_CONFIG_2)
-        config = modem_config_2 | 0x04 if enable_CRC else modem_config_2 & 0xfb 
-        self.writeRegister(self.REG_MODEM_CONFIG_2, config)
+        self.configure(enable_CRC = enable_CRC)
   
  
     def setSyncWord(self, sw):
-        self.writeRegister(self.REG_SYNC_WORD, sw)
+        self.configure(sync_word = sw)
          
 
     def implicitHeaderMode(self, implicitHeaderMode = False):
         if self._implicitHeaderMode != implicitHeaderMode:  # set value only if different.
             self._implicitHeaderMode = implicitHeaderMode
-            modem_config_1 = self.readRegister(self.REG_MODEM_CONFIG_1)
+            self.parameters['implicitHeader'] = implicitHeaderMode
+            self._airtime = None
+            modem_config_1 = self.readCachedRegister(self.REG_MODEM_CONFIG_1)
             config = modem_config_1 | 0x01 if implicitHeaderMode else modem_config_1 & 0xfe
             self.writeRegister(self.REG_MODEM_CONFIG_1, config)
        
 
     def attach_irq_handler(self, pin, method):
-        pin.irq(handler=method, trigger=Pin.IRQ_RISING)
+        if self.irq_scheduler:
+            # handlers run outside of interrupt context, the bus lock is safe to wait on
+            self.spi.use_lock()
+            method = self.irq_scheduler.defer(pin, method)
+        pin.irq(handler=method, trigger=IRQ_RISING)
 
     def detach_irq_handler(self, pin):
         pin.irq(handler=None, trigger=0)
@@ -291,10 +645,25 @@ class SX127x:
         
         if self.pin_RxDone:
             if callback:
-                self.writeRegister(self.REG_DIO_MAPPING_1, 0x00)
-                self.attach_irq_handler(self.pin_RxDone, self.handleOnReceive)
-            else:
+                self.setDioMapping(0, self.DIO0_RX_DONE)
+                self.attach_irq_handler(self.pin_RxDone, self.handleOnDio0)
+            elif not (self._tx_pending or self._on_packet):
                 self.detach_irq_handler(self.pin_RxDone)
+
+
+    def onTxDone(self, callback):
+        # called as callback(lora, success) when a non-blocking endPacket() completes,
+        # success is False only once poll_tx() finds the deadline passed.
+        self._on_tx_done = callback
+
+
+    def setDioMapping(self, dio, mapping):
+        # DIO0..DIO3, two bits each in REG_DIO_MAPPING_1, DIO0 in the top bits.
+        shift = 6 - 2 * dio
+        value = (self._dioMapping1 & ~(0x03 << shift) & 0xff) | (mapping << shift)
+        if value != self._dioMapping1:
+            self._dioMapping1 = value
+            self.writeRegister(self.REG_DIO_MAPPING_1, value)
         
 
     def receive(self, size = 0):
@@ -303,21 +672,127 @@ class SX127x:
         
         # The last packet always starts at FIFO_RX_CURRENT_ADDR
         # no need to reset FIFO_ADDR_PTR
+        self._startHopping()
         self.writeRegister(self.REG_OP_MODE, self.MODE_LONG_RANGE_MODE | self.MODE_RX_CONTINUOUS)
                  
                  
     # on RPi, interrupt callback is threaded and racing with main thread, 
-    # Needs a lock for accessing FIFO.
+    # SpiBus locks each transaction, an IrqScheduler moves the handlers to one thread.
     # https://sourceforge.net/p/raspberry-gpio-python/wiki/Inputs/
     # http://raspi.tv/2013/how-to-use-interrupts-with-python-on-the-raspberry-pi-and-rpi-gpio-part-2
+    def handleOnDio0(self, event_source):
+        if self._rx_polling:
+            return
+        if self._tx_pending:
+            self.handleOnTxDone(event_source)
+        else:
+            self.handleOnReceive(event_source)
+
+
+    def handleOnTxDone(self, event_source):
+        if self.getIrqFlags() & self.IRQ_TX_DONE_MASK:
+            self._finish_tx(True)
+
+
     def handleOnReceive(self, event_source):
+        if self.rx_ring is not None:
+            self.receive_into_ring(ticks_us())
+            return
 
-        # irqFlags = self.getIrqFlags() should be 0x50
-        if (self.getIrqFlags() & self.IRQ_PAYLOAD_CRC_ERROR_MASK) == 0:
+        # irqFlags = self.getIrqFlags() should be 0x50, a deferred handler may find other flags
+        irqFlags = self.getIrqFlags()
+        if irqFlags & self.IRQ_RX_DONE_MASK and (irqFlags & self.IRQ_PAYLOAD_CRC_ERROR_MASK) == 0:
             if self._on_receive:
                 payload = self.read_payload()                
                 self._on_receive(self, payload)
 
+
+    def setReceiveRing(self, ring):
+        # with a PacketRing, the IRQ handler only copies the FIFO into the ring
+        # and the receive callback is dispatched later, outside of the IRQ.
+        self.rx_ring = ring
+
+
+    def onPacket(self, callback):
+        # with a receive ring, called as callback(lora, packet) instead of the
+        # receive callback. packet.payload is only valid until the callback returns.
+        self._on_packet = callback
+
+        if self.pin_RxDone:
+            if callback:
+                self.setDioMapping(0, self.DIO0_RX_DONE)
+                self.attach_irq_handler(self.pin_RxDone, self.handleOnDio0)
+            elif not (self._tx_pending or self._on_receive):
+                self.detach_irq_handler(self.pin_RxDone)
+
+
+    def receive_into_ring(self, timestamp):
+        # snapshot FIFO address, IRQ flags, length, SNR and RSSI in one burst
+        status = self._status_buffer
+        self.readBurst(self.REG_FIFO_RX_CURRENT_ADDR, status)
+
+        irqFlags = status[self.STATUS_IRQ_FLAGS]
+        self.writeRegister(self.REG_IRQ_FLAGS, irqFlags)
+        if not irqFlags & self.IRQ_RX_DONE_MASK:
+            return
+        crc_ok = (irqFlags & self.IRQ_PAYLOAD_CRC_ERROR_MASK) == 0
+        if not (crc_ok or self.accept_crc_errors):
+            return
+
+        ring = self.rx_ring
+        slot = ring.reserve()
+        if slot < 0:
+            return
+
+        fei = self._fei_buffer
+        self.readBurst(self.REG_FEI_MSB, fei)
+
+        packet = ring.packets[slot]
+        snr = status[self.STATUS_PKT_SNR_VALUE]
+        fei_raw = ((fei[0] & 0x0f) << 16) | (fei[1] << 8) | fei[2]
+        packet.timestamp = timestamp
+        packet.crc_ok = crc_ok
+        packet.rssi = status[self.STATUS_PKT_RSSI_VALUE] - self._rssi_offset
+        packet.snr_raw = snr - 256 if snr > 127 else snr
+        packet.fei_raw = fei_raw - 0x100000 if fei_raw & 0x80000 else fei_raw
+        packet.bandwidth = self.parameters['signal_bandwidth']
+
+        # read the payload, its address and length are already known
+        packetLength = self.readRegister(self.REG_PAYLOAD_LENGTH) if self._implicitHeaderMode else \
+                       status[self.STATUS_RX_NB_BYTES]
+        self.writeRegister(self.REG_FIFO_ADDR_PTR, status[0])
+        buffer = ring.buffers[slot]
+        packetLength = min(packetLength, len(buffer))
+        if packetLength:
+            self.readBurst(self.REG_FIFO, buffer[:packetLength])
+        packet.length = packetLength
+        ring.commit(slot, packetLength)
+
+        if not self._dispatch_scheduled:
+            self._dispatch_scheduled = True
+            try:
+                schedule(self._dispatch_received, None)
+            except RuntimeError:  # schedule queue full, retried on the next packet
+                self._dispatch_scheduled = False
+
+
+    def dispatch_received(self, arg = None):
+        self._dispatch_scheduled = False
+        ring = self.rx_ring
+
+        slot = ring.peek()
+        while slot >= 0:
+            # the slot is released even if the callback raises, or it would be delivered forever
+            try:
+                if self._on_packet:
+                    self._on_packet(self, ring.packet(slot))
+                elif self._on_receive:
+                    self._on_receive(self, bytes(ring.payload(slot)))
+            finally:
+                ring.release()
+                self.memory_policy.packet_done()
+            slot = ring.peek()
+
         
     def receivedPacket(self, size = 0):
         irqFlags = self.getIrqFlags()
@@ -338,50 +813,171 @@ class SX127x:
             # reset FIFO address / # enter single RX mode
             self.writeRegister(self.REG_FIFO_ADDR_PTR, self.FIFO_RX_BASE_ADDR)
             self.writeRegister(self.REG_OP_MODE, self.MODE_LONG_RANGE_MODE | self.MODE_RX_SINGLE)
+
+
+    def receiveSingle(self):
+        # RX_SINGLE: the radio goes back to standby on RX_DONE, or on RX_TIMEOUT when
+        # no preamble is found within symbol_timeout symbols. returns the payload or None.
+        timeout_ms = int(self.symbol_time_ms() * self.parameters['symbol_timeout'] +
+                         self.time_on_air_ms(self.MAX_PKT_LENGTH)) + self.TX_TIMEOUT_MARGIN_MS
+
+        self._rx_polling = True
+        try:
+            self.writeRegister(self.REG_IRQ_FLAGS, 0xff)
+            self.writeRegister(self.REG_FIFO_ADDR_PTR, self.FIFO_RX_BASE_ADDR)
+            self._startHopping()
+            self.writeRegister(self.REG_OP_MODE, self.MODE_LONG_RANGE_MODE | self.MODE_RX_SINGLE)
+            start = ticks_ms()
+
+            while True:
+                irqFlags = self.readRegister(self.REG_IRQ_FLAGS)
+                if irqFlags & (self.IRQ_RX_DONE_MASK | self.IRQ_RX_TIME_OUT_MASK):
+                    break
+                if irqFlags & self.IRQ_FHSS_CHANGE_CHANNEL_MASK:
+                    self.handleOnFhssChangeChannel(None)
+                if ticks_diff(ticks_ms(), start) > timeout_ms:
+                    self.standby()
+                    return None
+
+            self.writeRegister(self.REG_IRQ_FLAGS, irqFlags)
+            if irqFlags & self.IRQ_RX_DONE_MASK and not irqFlags & self.IRQ_PAYLOAD_CRC_ERROR_MASK:
+                return self.read_payload()
+            return None
+
+        finally:
+            self._rx_polling = False
+
+
+    def sniff_interval_ms(self):
+        # longest sleep between two CADs that still catches every preamble
+        symbols = self.parameters['preamble_length'] - self.SNIFF_MARGIN_SYMBOLS
+        return max(int(symbols * self.symbol_time_ms()), 0)
+
+
+    def sniff(self, interval_ms = None, sleep = lightsleep_ms):
+        # one cycle of the duty-cycled receive mode: CAD, full receive only when a
+        # preamble is detected, then radio and MCU sleep until the next cycle.
+        # senders need a preamble much longer than SNIFF_MARGIN_SYMBOLS.
+        # the payload is passed to the receive callback and returned, None if nothing came in.
+        payload = None
+        if self.cad():
+            payload = self.receiveSingle()
+            if payload is not None and self._on_receive:
+                self._on_receive(self, payload)
+
+        self.sleep()
+        sleep(self.sniff_interval_ms() if interval_ms is None else interval_ms)
+        return payload
         
             
     def read_payload(self):
+        size = self.read_payload_into(self._payload_buffer)
+        payload = bytes(memoryview(self._payload_buffer)[:size])
+
+        self.memory_policy.packet_done()
+        return payload
+
+
+    def read_payload_into(self, buffer):
         # set FIFO address to current RX address
-        # fifo_rx_current_addr = self.readRegister(REG_FIFO_RX_CURRENT_ADDR)
         self.writeRegister(self.REG_FIFO_ADDR_PTR, self.readRegister(self.REG_FIFO_RX_CURRENT_ADDR))
-        
+
         # read packet length
         packetLength = self.readRegister(self.REG_PAYLOAD_LENGTH) if self._implicitHeaderMode else \
                        self.readRegister(self.REG_RX_NB_BYTES)
-                       
-        payload = bytearray()
-        for i in range(packetLength):
-            payload.append(self.readRegister(self.REG_FIFO))
-        
-        self.collect_garbage()
-        return bytes(payload)
-
-
-    def transfer(self, pin_ss, address, value=0x00):
-
-        response = bytearray(1)
 
-        pin_ss.value(0)
+        # read the whole packet in a single burst, truncated to the buffer size
+        size = min(packetLength, len(buffer))
+        if size < len(buffer):
+            buffer = memoryview(buffer)[:size]
+        if size:
+            self.readBurst(self.REG_FIFO, buffer)
+        return size
 
-        self.spi.write(bytes([address]))
-        self.spi.write_readinto(bytes([value]), response)
+    recv_into = read_payload_into
 
-        pin_ss.value(1)
 
-        return response
+    def transfer(self, pin_ss, address, value=0x00):
+        # address and value go out in one two-byte transaction through the
+        # preallocated buffers, the register content comes back in the second byte.
+        # the buffers are filled under the bus lock too, handlers may run on another thread.
+        bus = self.spi
+        bus.acquire()
+        try:
+            tx = self._tx_buffer
+            tx[0] = address
+            tx[1] = value
+            pin_ss.value(0)
+            bus.write_readinto(tx, self._rx_buffer)
+            pin_ss.value(1)
+            value = self._rx_buffer[1]
+        finally:
+            bus.release()
+
+        return value
 
         
     def readRegister(self, address, byteorder = 'big', signed = False):
-        response = self.transfer(self.pin_ss, address & 0x7f) 
-        return int.from_bytes(response, byteorder)        
+        return self.transfer(self.pin_ss, address & 0x7f)
         
 
     def writeRegister(self, address, value):
+        if address in self._shadow:
+            self._shadow[address] = value
         self.transfer(self.pin_ss, address | 0x80, value)
 
 
+    def readCachedRegister(self, address):
+        # served from the shadow copy, only hits the bus the first time.
+        value = self._shadow[address]
+        if value is None:
+            value = self.readRegister(address)
+            self._shadow[address] = value
+        return value
+
+
+    def refresh(self):
+        for address in self._shadow:
+            self._shadow[address] = self.readRegister(address)
+
+
+    def invalidate(self):
+        for address in self._shadow:
+            self._shadow[address] = None
+
+
+    def writeBurst(self, address, buffer):
+        # CS is held low for the whole buffer, the chip auto-increments the
+        # address (or the FIFO pointer when writing REG_FIFO).
+        bus = self.spi
+        bus.acquire()
+        try:
+            self._tx_buffer[0] = address | 0x80
+            self.pin_ss.value(0)
+            bus.write(self._address_buffer)
+            bus.write(buffer)
+            self.pin_ss.value(1)
+        finally:
+            bus.release()
+
+        if address != self.REG_FIFO:
+            for i in range(len(buffer)):
+                if address + i in self._shadow:
+                    self._shadow[address + i] = buffer[i]
+
+
+    def readBurst(self, address, buffer):
+        bus = self.spi
+        bus.acquire()
+        try:
+            self._tx_buffer[0] = address & 0x7f
+            self.pin_ss.value(0)
+            bus.write(self._address_buffer)
+            bus.readinto(buffer)
+            self.pin_ss.value(1)
+        finally:
+            bus.release()
+
+
     def collect_garbage(self):
-        gc.collect()
-        if CONFIG.IS_MICROPYTHON:
-            print('[Memory - free: {}   allocated: {}]'.format(gc.mem_free(), gc.mem_alloc()))
-            
\ No newline at end of file
+        self.memory_policy.collect()
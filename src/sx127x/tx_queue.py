@@ -0,0 +1,138 @@
+from sx127x.clock import ticks_ms, ticks_diff, ticks_add
+from sx127x.schedule import schedule
+
+
+class TxQueue:
+    """
+    Bounded transmit queue for an SX127x. Messages are sent highest priority first,
+    in order per destination, and dropped once they can no longer be on air before
+    their deadline. The radio goes back to receive mode when the queue is drained.
+    """
+
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+    # entry fields
+    SEQ = 0
+    PRIORITY = 1
+    PAYLOAD = 2
+    DESTINATION = 3
+    DEADLINE = 4
+
+    def __init__(self, lora, size = 8, priorities = 3, listen = True):
+        self.lora = lora
+        self.size = size
+        self.listen = listen
+        self.queues = [[] for i in range(priorities)]
+        self.count = 0
+        self.seq = 0
+        self.sent = 0
+        self.failed = 0
+        self.expired = 0
+        self.rejected = 0
+        self._sending = False
+        self._service = self.service  # bound once, scheduled from the TX done IRQ
+        lora.onTxDone(self._on_tx_done)
+
+
+    def __len__(self):
+        return self.count
+
+
+    def put(self, payload, priority = NORMAL, destination = None, ttl_ms = None):
+        # False when the queue is full, the caller decides to retry or drop.
+        # a payload that does not fit the FIFO is refused here, not at send time.
+        if len(payload) > self.lora.max_payload_length():
+            raise ValueError('Payload too long.')
+        if self.count >= self.size:
+            self.rejected += 1
+            return False
+
+        deadline = None if ttl_ms is None else ticks_add(ticks_ms(), ttl_ms)
+        self.queues[priority].append((self.seq, priority, payload, destination, deadline))
+        self.seq += 1
+        self.count += 1
+        return True
+
+
+    def service(self, arg = None):
+        # starts the next transmission if the radio is free, True if one was started.
+        # call it from the main loop, it is also chained after every TX done.
+        lora = self.lora
+        if not lora.poll_tx() or lora.isReceiving():
+            return False
+        if lora.duty_cycle and lora.duty_cycle.delay_ms(lora.tuned_frequency()):
+            return False
+
+        entry = self._pop()
+        if entry is None:
+            if self._sending:
+                self._sending = False
+                if self.listen:
+                    lora.receive()
+            return False
+
+        self._sending = True
+        try:
+            lora.beginPacket()
+            lora.write(entry[self.PAYLOAD])
+            lora.endPacket(wait = False)
+        except Exception:
+            self.failed += 1
+            return False
+        return True
+
+
+    def _on_tx_done(self, lora, success):
+        if success:
+            self.sent += 1
+        else:
+            self.failed += 1
+        try:
+            schedule(self._service, None)
+        except RuntimeError:  # picked up by the next service() from the main loop
+            pass
+
+
+    def _expire(self):
+        now = ticks_ms()
+        lora = self.lora
+        for queue in self.queues:
+            i = 0
+            while i < len(queue):
+                entry = queue[i]
+                deadline = entry[self.DEADLINE]
+                if deadline is not None and \
+                   ticks_diff(deadline, now) < lora.time_on_air_ms(len(entry[self.PAYLOAD])):
+                    del queue[i]
+                    self.count -= 1
+                    self.expired += 1
+                else:
+                    i += 1
+
+
+    def _pop(self):
+        self._expire()
+
+        entry = None
+        for queue in self.queues:
+            if queue:
+                entry = queue[0]
+                break
+        if entry is None:
+            return None
+
+        # an older message to the same destination, queued at a lower priority, goes first
+        destination = entry[self.DESTINATION]
+        if destination is not None:
+            for queue in self.queues:
+                for candidate in queue:
+                    if candidate[self.DESTINATION] == destination:
+                        if candidate[self.SEQ] < entry[self.SEQ]:
+                            entry = candidate
+                        break
+
+        self.queues[entry[self.PRIORITY]].remove(entry)
+        self.count -= 1
+        return entry
@@ -0,0 +1,94 @@
+# SPI bus locking: a DIO handler taken in the middle of a transaction must not deadlock.
+
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from sx127x.bus import IrqScheduler, SpiBus
+from sx127x.emulator import Emulator
+from sx127x.sx127x import SX127x
+
+
+class InterruptingSPI:
+    """
+    The emulator's SPI, running `interrupt` once inside the next transaction,
+    the way a pin IRQ or scheduled callback runs between two bytecodes.
+    """
+
+    def __init__(self, chip):
+        self.chip = chip
+        self.interrupt = None
+
+    def write(self, buffer):
+        self.chip.write(buffer)
+
+    def readinto(self, buffer, write = 0x00):
+        self.chip.readinto(buffer, write)
+
+    def write_readinto(self, out, into):
+        self.chip.write_readinto(out, into)
+        interrupt, self.interrupt = self.interrupt, None
+        if interrupt:
+            # a real handler selects the chip again, the emulator only checks the bus here
+            selected, self.chip.selected = self.chip.selected, False
+            interrupt()
+            self.chip.selected = selected
+
+
+def run_with_timeout(func, timeout = 2):
+    thread = threading.Thread(target = func, daemon = True)
+    thread.start()
+    thread.join(timeout)
+    return not thread.is_alive()
+
+
+def test_handler_inside_a_transaction_does_not_deadlock():
+    chip = Emulator()
+    spi = InterruptingSPI(chip)
+    lora = chip.attach(SX127x('915E6', spi))
+
+    def transaction():
+        spi.interrupt = lambda: lora.readRegister(SX127x.REG_IRQ_FLAGS)
+        lora.standby()
+
+    assert run_with_timeout(transaction)
+
+
+def test_second_transceiver_turns_the_lock_on():
+    spi = InterruptingSPI(Emulator())
+    bus = SpiBus.of(spi)
+    first = SX127x('915E6', spi)
+    second = SX127x('868E6', spi)
+
+    bus.join(first)
+    assert bus.acquire(0) and bus.acquire(0)  # no lock yet
+    bus.release()
+    bus.release()
+
+    bus.join(second)
+    assert bus.acquire(0)
+    assert not bus.acquire(0)
+    bus.release()
+
+
+def test_scheduler_turns_the_lock_on_and_defers_handlers():
+    chip = Emulator()
+    chip.schedule = None
+    lora = SX127x('915E6', chip)
+    lora.irq_scheduler = scheduler = IrqScheduler()
+    chip.attach(lora)
+
+    received = []
+    lora.onReceive(lambda lora, payload: received.append(payload))
+    lora.receive()
+    assert lora.spi.acquire(0)
+    assert not lora.spi.acquire(0)
+    lora.spi.release()
+
+    chip.receive(b'hello')
+    chip.fire()
+    assert received == []
+    assert scheduler.service() == 1
+    assert received == [b'hello']
@@ -0,0 +1,53 @@
+# configure() only writes what changed, in as few SPI transactions as it can.
+# Counted on the emulator, each transaction is one chip select.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from sx127x.channels import ChannelPlan
+from sx127x.emulator import Emulator
+from sx127x.sx127x import SX127x
+
+
+def make_radio():
+    chip = Emulator()
+    chip.schedule = None
+    return chip, chip.attach(SX127x('868.1E6', None))
+
+
+def transactions(chip, func):
+    before = chip.transactions
+    func()
+    return chip.transactions - before
+
+
+def test_unchanged_parameters_do_not_touch_the_bus():
+    chip, lora = make_radio()
+    parameters = dict(lora.parameters)
+    assert transactions(chip, lambda: lora.configure(**parameters)) == 0
+
+
+def test_modem_settings_go_out_in_one_burst():
+    chip, lora = make_radio()
+    assert transactions(chip, lambda: lora.configure(spreading_factor = 10, signal_bandwidth = 250E3)) == 1
+    assert chip.regs[SX127x.REG_MODEM_CONFIG_2] >> 4 == 10
+    assert chip.regs[SX127x.REG_MODEM_CONFIG_1] >> 4 == 8     # 250 kHz
+
+    assert transactions(chip, lambda: lora.configure(spreading_factor = 10, signal_bandwidth = 250E3)) == 0
+
+
+def test_frequency_and_power_are_single_transactions():
+    chip, lora = make_radio()
+    assert transactions(chip, lambda: lora.configure(frequency = 869.525E6)) == 1
+    assert lora.tuned_frequency() == 869.525E6
+    assert transactions(chip, lambda: lora.configure(tx_power_level = 10)) == 1
+
+
+def test_set_channel_is_one_burst():
+    chip, lora = make_radio()
+    plan = ChannelPlan((868.1E6, 868.3E6, 868.5E6))
+    assert transactions(chip, lambda: lora.setChannel(plan, 2)) == 1
+    assert bytes(chip.regs[0x06:0x09]) == bytes(plan.frfs[2])
+    assert lora.tuned_frequency() == 868.5E6
@@ -0,0 +1,81 @@
+# Frame encoding and cross-packet FEC, alone and over a lossy emulated link.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from sx127x import fec, frame
+from sx127x.emulator import Emulator
+from sx127x.sx127x import SX127x
+
+
+def test_frame_round_trip():
+    buffer = bytearray(frame.HEADER_LENGTH + 3 * frame.MAX_VARINT_LENGTH)
+    length = frame.pack_into(buffer, frame.TYPE_DATA, 0xbeef, 300, (0, -1, 1 << 30), frame.FLAG_ACK_REQUESTED)
+
+    fields = [0] * 3
+    assert frame.unpack_from(buffer, fields, length) == (frame.TYPE_DATA, 0xbeef, 300 & 0xff, frame.FLAG_ACK_REQUESTED, 3)
+    assert fields == [0, -1, 1 << 30]
+
+
+def test_malformed_frames_are_invalid():
+    fields = [0] * 2
+    assert frame.unpack_from(b'\x00\x01', fields)[0] == frame.TYPE_INVALID
+    # a varint that runs past the end of the frame
+    assert frame.unpack_from(b'\x00\x00\x01\x02\x80\x80', fields)[0] == frame.TYPE_INVALID
+    assert frame.unpack_varint_from(b'\xff' * 8, 0) == (None, 8)
+
+
+def test_fec_rebuilds_any_k_of_k_plus_r():
+    encoder = fec.FecEncoder(4, 2)
+    packets = [b'a', b'', b'longer packet', b'\x00\xff' * 10]
+    frames = list(encoder.frames(packets))
+
+    for lost in ((0, 1), (2, 3), (1, 4), (3, 5)):
+        decoder = fec.FecDecoder()
+        result = None
+        for i in range(len(frames)):
+            if i not in lost:
+                result = decoder.feed(frames[i]) or result
+        assert result == packets
+    assert decoder.recovered == 1
+
+
+def test_fec_drops_inconsistent_frames():
+    decoder = fec.FecDecoder()
+    assert decoder.feed(b'\x01\x00\x02\x01abcdef') is None
+    assert decoder.feed(b'\x01\x02\x02\x01x') is None       # repair shorter than a data packet
+    assert decoder.feed(b'\x01\x01\x03\x01abc') is None     # K changed within the block
+    assert decoder.feed(b'\x01\x00\x00\x01') is None        # K of 0
+    assert decoder.dropped == 3
+
+
+def test_fec_over_a_lossy_link():
+    chips = Emulator(), Emulator()
+    chips[0].link(chips[1])
+    sender, receiver = [chip.attach(SX127x('868.1E6', None)) for chip in chips]
+    chips[1].schedule = None
+
+    decoder = fec.FecDecoder()
+    blocks = []
+
+    def on_receive(lora, payload):
+        block = decoder.feed(payload)
+        if block is not None:
+            blocks.append(block)
+
+    receiver.onReceive(on_receive)
+    receiver.receive()
+
+    packets = [bytes([i]) * (10 + i) for i in range(6)]
+    for i, payload in enumerate(fec.FecEncoder(6, 3).frames(packets)):
+        if i in (0, 4, 7):
+            continue        # lost in the air
+        sender.beginPacket()
+        sender.write(payload)
+        sender.endPacket()
+        chips[1].fire()
+
+    assert blocks == [packets]
+    assert decoder.recovered == 2
@@ -0,0 +1,124 @@
+# Two linked emulators: ARQ and fragmented traffic end to end, through the driver's
+# DIO0 handling. Handlers are queued (schedule = None) and run with fire(),
+# right after each packet for bursts, the way an IRQ would take every one.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from sx127x.arq import ReliableLink
+from sx127x.emulator import Emulator
+from sx127x.fragment import Fragmenter, Reassembler
+from sx127x.sx127x import SX127x
+
+
+def make_link():
+    chips = Emulator(), Emulator()
+    chips[0].link(chips[1])
+    radios = []
+    for chip in chips:
+        chip.schedule = None
+        radios.append(chip.attach(SX127x('868.1E6', None)))
+    return chips, radios
+
+
+def handle_each_packet(chip, drop_every = None):
+    # runs the handlers after every packet in the air, drop_every misses every n-th one
+    receive = chip.receive
+    count = [0]
+
+    def receive_and_fire(payload, *args, **kwargs):
+        count[0] += 1
+        if drop_every and count[0] % drop_every == 0:
+            return False
+        heard = receive(payload, *args, **kwargs)
+        chip.fire()
+        return heard
+
+    chip.receive = receive_and_fire
+
+
+def arq_transfer(messages, loss = None):
+    chips, radios = make_link()
+    received = []
+    # no timers: every service() retransmits what is unacknowledged and sends the ACK
+    timers = dict(initial_rto_ms = 0, min_rto_ms = 0, max_rto_ms = 0, ack_delay_ms = 0)
+    sender = ReliableLink(radios[0], lambda payload: None, **timers)
+    receiver = ReliableLink(radios[1], received.append, **timers)
+    radios[0].onReceive(lambda lora, payload: sender.on_packet(payload))
+    radios[1].onReceive(lambda lora, payload: receiver.on_packet(payload))
+    for chip, radio in zip(chips, radios):
+        handle_each_packet(chip, loss)
+        radio.receive()
+
+    pending = list(messages)
+    for step in range(1000):
+        while pending and sender.send(pending[0]):
+            pending.pop(0)
+        receiver.service()
+        sender.service()
+        if not pending and sender.in_flight() == 0:
+            break
+    return sender, receiver, received, chips
+
+
+def test_arq_delivers_in_order():
+    messages = [bytes([i]) * 8 for i in range(20)]
+    sender, receiver, received, chips = arq_transfer(messages)
+    assert received == messages
+    assert sender.retransmissions == 0 and sender.failures == 0
+
+
+def test_arq_recovers_lost_frames():
+    messages = [bytes([i]) * 8 for i in range(20)]
+    sender, receiver, received, chips = arq_transfer(messages, loss = 3)
+    assert received == messages
+    assert sender.retransmissions > 0 and sender.failures == 0
+    assert chips[0].missed == 0  # losses are injected, the radios were always listening
+
+
+def test_arq_batches_acks():
+    chips, radios = make_link()
+    sender = ReliableLink(radios[0], lambda payload: None, window = 4)
+    receiver = ReliableLink(radios[1], lambda payload: None, window = 4, ack_delay_ms = 60000)
+    radios[1].onReceive(lambda lora, payload: receiver.on_packet(payload))
+    radios[1].receive()
+
+    for i in range(3):
+        sender.send(b'data')
+        chips[1].fire()
+    receiver.service()
+    assert chips[1].transmitted == []       # the ACK waits for the burst to end
+
+    sender.send(b'last')                    # fills the window, asks for the ACK
+    chips[1].fire()
+    receiver.service()
+    assert len(chips[1].transmitted) == 1
+
+
+def test_fragments_reassemble_out_of_order():
+    chips, radios = make_link()
+    reassembler = Reassembler(max_length = 1024)
+    messages = []
+
+    def on_receive(lora, payload):
+        message = reassembler.feed(payload, source = 1)
+        if message is not None:
+            messages.append(bytes(message))
+
+    radios[1].onReceive(on_receive)
+    radios[1].receive()
+
+    data = bytes(range(256)) * 3
+    fragments = list(Fragmenter.for_radio(radios[0]).fragments(data))
+    assert len(fragments) > 1
+    for fragment in reversed(fragments + fragments[:1]):   # one late duplicate
+        radios[0].beginPacket()
+        radios[0].write(fragment)
+        radios[0].endPacket()
+        chips[1].fire()
+
+    assert messages == [data]
+    assert reassembler.duplicates == 1
+    assert reassembler.dropped == 0
@@ -0,0 +1,104 @@
+# Register access must not allocate in steady state.
+# Runs on CPython with tracemalloc, or on MicroPython with gc.mem_alloc().
+
+import gc
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from sx127x.sx127x import SX127x
+
+
+ACCESSES = 5000
+
+
+class FakeSPI:
+    """
+    Register file behind a preallocated transaction, the first byte is the address.
+    Every transaction has to come in the radio's own buffers, a fresh one fails.
+    """
+
+    def __init__(self):
+        self.registers = bytearray(0x80)
+        self.registers[SX127x.REG_VERSION] = 0x12
+        self.lora = None
+
+    def write_readinto(self, out, into):
+        assert out is self.lora._tx_buffer and into is self.lora._rx_buffer
+        address = out[0] & 0x7f
+        into[0] = 0
+        into[1] = self.registers[address]
+        if out[0] & 0x80:
+            self.registers[address] = out[1]
+
+    def write(self, buffer):
+        pass
+
+    def readinto(self, buffer, write = 0x00):
+        pass
+
+
+class FakePin:
+
+    def value(self, value = None):
+        return 1
+
+
+def make_radio():
+    spi = FakeSPI()
+    lora = SX127x('915E6', spi)
+    lora.pin_ss = FakePin()
+    spi.lora = lora
+    return lora
+
+
+def access(lora, count):
+    for i in range(count):
+        lora.writeRegister(SX127x.REG_SYNC_WORD, i & 0xff)
+        lora.readRegister(SX127x.REG_SYNC_WORD)
+        lora.readRegister(SX127x.REG_IRQ_FLAGS)
+
+
+def allocated_bytes(lora, count):
+    access(lora, 10)  # warm up
+    gc.collect()
+
+    if hasattr(gc, 'mem_alloc'):
+        gc.disable()
+        before = gc.mem_alloc()
+        access(lora, count)
+        growth = gc.mem_alloc() - before
+        gc.enable()
+        return growth
+
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        access(lora, count)
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    driver = [tracemalloc.Filter(True, '*sx127x*')]
+    stats = after.filter_traces(driver).compare_to(before.filter_traces(driver), 'filename')
+    return sum(stat.size_diff for stat in stats)
+
+
+def test_register_access_does_not_allocate():
+    lora = make_radio()
+    assert allocated_bytes(lora, ACCESSES) <= 0
+
+
+def test_register_access_round_trip():
+    lora = make_radio()
+    lora.writeRegister(SX127x.REG_SYNC_WORD, 0x34)
+    assert lora.readRegister(SX127x.REG_SYNC_WORD) == 0x34
+    assert lora.readRegister(SX127x.REG_VERSION) == 0x12
+
+
+if __name__ == '__main__':
+    test_register_access_does_not_allocate()
+    test_register_access_round_trip()
+    print('ok')
@@ -0,0 +1,88 @@
+# Receive ring: the DIO0 handler copies packets into preallocated slots and
+# counts an overrun when the dispatcher has not freed one in time.
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from sx127x.emulator import Emulator
+from sx127x.ring import PacketRing
+from sx127x.sx127x import SX127x
+
+
+def make_radio(slots):
+    chip = Emulator(rssi = -80, snr = 6.5)
+    chip.schedule = None
+    lora = chip.attach(SX127x('868.1E6', None))
+    ring = PacketRing(slots)
+    lora.setReceiveRing(ring)
+    return chip, lora, ring
+
+
+def wait_for(condition, timeout = 2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
+
+def test_packets_carry_their_metadata():
+    chip, lora, ring = make_radio(2)
+    received = []
+    lora.onPacket(lambda lora, packet: received.append((bytes(packet.payload), packet.rssi, packet.snr)))
+    lora.receive()
+
+    chip.receive(b'first')
+    chip.fire()
+    chip.receive(b'second', rssi = -100, snr = -2.5)
+    chip.fire()
+
+    assert wait_for(lambda: len(received) == 2)
+    assert received == [(b'first', -80, 6.5), (b'second', -100, -2.5)]
+    assert ring.overruns == 0 and len(ring) == 0
+
+
+def test_full_ring_counts_overruns():
+    chip, lora, ring = make_radio(2)
+    gate = threading.Event()
+    received = []
+
+    def on_packet(lora, packet):
+        gate.wait(2)    # the dispatcher is busy, the slot stays taken
+        received.append(bytes(packet.payload))
+
+    lora.onPacket(on_packet)
+    lora.receive()
+    for payload in (b'one', b'two', b'three', b'four'):
+        chip.receive(payload)
+        chip.fire()
+
+    assert ring.overruns == 2
+    gate.set()
+    assert wait_for(lambda: len(received) == 2)
+    assert received == [b'one', b'two']
+    assert len(ring) == 0
+
+
+def test_slot_is_released_when_the_callback_raises():
+    chip, lora, ring = make_radio(1)
+    received = []
+
+    def on_packet(lora, packet):
+        received.append(bytes(packet.payload))
+        raise ValueError('callback failed')
+
+    lora.onPacket(on_packet)
+    lora.receive()
+    for payload in (b'one', b'two'):
+        chip.receive(payload)
+        chip.fire()
+        assert wait_for(lambda: len(ring) == 0)
+
+    assert received == [b'one', b'two']
+    assert ring.overruns == 0